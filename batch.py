@@ -0,0 +1,155 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from imu_data import CACHE_SUFFIX, load_recording
+from imu_trace import TRACE_SUFFIX
+from orientation_engine import run_filters, STREAMS
+from orientation_result import save_results
+
+# --- Batch Processing ---
+# Runs the filters over many IMU CSV files in a process pool. Each file's results are written to the
+# output directory, plus an index.json summarising every file. A file that fails is recorded in the
+# index with its error, the rest of the batch carries on.
+#
+# Batch runs don't write the binary data cache next to each CSV by default (--cache to enable), so
+# nightly jobs leave the session directories as they are.
+
+# Files treated as recordings
+INPUT_SUFFIXES = ('.csv', TRACE_SUFFIX)
+
+
+# Expand directories / globs into recordings
+def find_inputs(patterns):
+    """
+    :param patterns: list of files, directories (all recordings inside) or glob patterns
+    :return: sorted list of CSV / .imut paths (other matches, e.g. binary data caches, are skipped)
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.update(glob.glob(os.path.join(pattern, '*')))
+        else:
+            paths.update(glob.glob(pattern))
+    return sorted(path for path in paths
+                  if path.endswith(INPUT_SUFFIXES) and not path.endswith(CACHE_SUFFIX) and os.path.isfile(path))
+
+
+# Process one recording
+def process_file(path, output, alpha, alpha_2, streams=STREAMS, fmt='npz', use_cache=False):
+    """
+    Runs the filters on one recording & saves the results
+    :param path: IMU CSV file
+    :param output: output file
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param streams: results to compute
+    :param fmt: output format, 'npz' or 'csv'
+    :param use_cache: read/write the binary data cache
+    :return: dict summary: input, output, status ('ok'/'failed'), samples, duration, seconds, error
+    """
+    start = time.perf_counter()
+    summary = {'input': path, 'output': None, 'status': 'failed', 'samples': 0, 'duration': None, 'error': None}
+    try:
+        data = load_recording(path, use_cache=use_cache)
+        results = run_filters(data, alpha, alpha_2, streams)
+        save_results(output, results, fmt)
+        summary.update(output=output, status='ok', samples=len(data),
+                       duration=float(data.time[-1] - data.time[0]) if len(data) else 0.0)
+    except Exception as e:
+        summary['error'] = '%s: %s' % (type(e).__name__, e)
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+# Output file for each input (unique within the output directory)
+def _output_paths(inputs, out_dir, fmt):
+    outputs = []
+    taken = set()
+    for path in inputs:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, n = stem, 1
+        while name in taken:
+            name = '%s_%d' % (stem, n)
+            n += 1
+        taken.add(name)
+        outputs.append(os.path.join(out_dir, name + '.' + fmt))
+    return outputs
+
+
+# Process many recordings
+def run_batch(inputs, out_dir, alpha, alpha_2, streams=STREAMS, fmt='npz', workers=None, use_cache=False,
+              progress=print):
+    """
+    Runs the filters on every input file across a process pool, writes each file's results & an
+    index.json summary into out_dir
+    :param inputs: list of IMU CSV files
+    :param out_dir: output directory
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param streams: results to compute
+    :param fmt: output format, 'npz' or 'csv'
+    :param workers: number of processes (default: number of CPUs)
+    :param use_cache: read/write the binary data cache of each file
+    :param progress: called with a progress message after each file (None = silent)
+    :return: list of per-file summaries (see process_file), in input order
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = _output_paths(inputs, out_dir, fmt)
+    summaries = [None] * len(inputs)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_file, path, output, alpha, alpha_2, streams, fmt, use_cache): i
+                   for i, (path, output) in enumerate(zip(inputs, outputs))}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            try:
+                summaries[i] = future.result()
+            except Exception as e:
+                # Worker process died (e.g. out of memory)
+                summaries[i] = {'input': inputs[i], 'output': None, 'status': 'failed', 'samples': 0,
+                                'duration': None, 'seconds': None, 'error': '%s: %s' % (type(e).__name__, e)}
+            if progress is not None:
+                summary = summaries[i]
+                status = summary['status'] if summary['error'] is None else 'failed (%s)' % summary['error']
+                progress("[%d/%d] %s: %s" % (done, len(inputs), inputs[i], status))
+
+    index = {'alpha': alpha, 'alpha_2': alpha_2, 'filters': list(streams), 'format': fmt,
+             'succeeded': sum(summary['status'] == 'ok' for summary in summaries),
+             'failed': sum(summary['status'] != 'ok' for summary in summaries),
+             'files': summaries}
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the orientation filters on many IMU CSV files")
+    parser.add_argument('inputs', nargs='+', help="CSV / .imut files, directories or glob patterns")
+    parser.add_argument('-o', '--out-dir', required=True, help="output directory")
+    parser.add_argument('--alpha', type=float, default=0.05, help="accelerometer gain (default: 0.05)")
+    parser.add_argument('--alpha-2', type=float, default=0.00001, help="magnetometer gain (default: 0.00001)")
+    parser.add_argument('--filters', nargs='+', choices=STREAMS, default=list(STREAMS),
+                        help="results to compute (default: all)")
+    parser.add_argument('--format', choices=('npz', 'csv'), default='npz', help="output format (default: npz)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="number of processes (default: CPUs)")
+    parser.add_argument('--cache', action='store_true',
+                        help="read/write a binary data cache next to each CSV (default: off)")
+    args = parser.parse_args(argv)
+
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        raise SystemExit("No recordings found")
+    summaries = run_batch(inputs, args.out_dir, args.alpha, args.alpha_2, args.filters, args.format,
+                          args.workers, args.cache)
+    failed = sum(summary['status'] != 'ok' for summary in summaries)
+    print("Finished: %d ok, %d failed. Index: %s" % (len(summaries) - failed, failed,
+                                                    os.path.join(args.out_dir, 'index.json')))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
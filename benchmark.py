@@ -0,0 +1,459 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import numpy as np
+from helperFunctions import *
+from imu_data import IMURecording, load_recording
+from gyro_integration import gyro_integration, gyro_integration_parallel
+from drift_correction import drift_correction
+from yaw_correction import yaw_correction
+from orientation_engine import GYRO, TILT, YAW, run_filters
+from orientation_result import OrientationResult
+from checkpoint import run_checkpointed, resume_from
+from multi_device import MultiDeviceTracker
+from multirate import adaptive_correction, multirate_correction, sensor_updates
+from plotter import BASIS, orientation_arrow_segments, playback_frames
+from decimation import m4_indices
+import jit_kernels
+
+# --- Benchmarks ---
+# Measures samples/s & peak memory of the helpers, the filters and the plot data preparation at
+# several recording lengths, on synthetic recordings that follow the statistics of IMUData.csv.
+#
+# Before anything is timed, every optimized path is checked against golden outputs of the reference
+# implementations (the per-sample helpers & filter loops), stored in GOLDEN_PATH. Timings are compared
+# against a baseline JSON saved on the same machine; a correctness failure or a case that got slower
+# (or uses more memory) by more than the tolerance makes the run exit with status 1.
+#
+#   python benchmark.py                        check golden outputs, benchmark, compare with baseline
+#   python benchmark.py --save-baseline        ... & store the results as the new baseline
+#   python benchmark.py --sizes 1e3 1e7        choose recording lengths (default 1e3 1e4 1e5)
+#   python benchmark.py --cases yaw helpers.   only run cases whose name starts with these
+#   python benchmark.py --update-golden        regenerate golden outputs (only when results change on purpose)
+
+GOLDEN_PATH = 'benchmark_golden.npz'
+BASELINE_PATH = 'benchmark_baseline.json'
+GOLDEN_SAMPLES = 1000
+DEFAULT_SIZES = (10 ** 3, 10 ** 4, 10 ** 5)
+ALPHA = 0.05
+ALPHA_2 = 0.00001
+# Allowed deviation from the golden outputs
+FILTER_TOLERANCE = 1e-9
+HELPER_TOLERANCE = 1e-12
+# Memory differences below this are ignored when comparing to the baseline
+MEMORY_SLACK = 1 << 20
+
+
+# Synthetic recording
+def synthetic_recording(n, source='IMUData.csv', seed=0):
+    """
+    Generates a recording of n samples that follows a real one. The gyro columns get the real sample
+    rate, per-column mean & standard deviation and (roughly) smoothness: white noise passed through a
+    moving average whose length follows the column's lag-1 autocorrelation. The accelerometer &
+    magnetometer readings are the real first readings (gravity & field at the initial orientation)
+    rotated into the body frame along the orientation the gyro describes, plus sensor noise, so they
+    agree with the gyro like real ones do. Like real ones, each is only updated every few rows (the
+    real recording's average update interval).
+    :param n: number of samples
+    :param source: recording the statistics are taken from
+    :param seed: random seed
+    :return: IMURecording
+    """
+    real = load_recording(source)
+    dt = float(np.median(np.diff(real.time)))
+    rng = np.random.default_rng(seed)
+
+    gyro = np.empty((n, 3))
+    for c, column in enumerate(real.gyro.T):
+        mean, std = column.mean(), column.std()
+        centred = column - mean
+        denom = np.dot(centred, centred)
+        rho = np.dot(centred[1:], centred[:-1]) / denom if denom else 0.0
+        rho = min(max(rho, 0.0), 0.999)
+        window = int(min(max(round((1 + rho) / (1 - rho)), 1), 1000))
+        noise = rng.standard_normal(n + window - 1)
+        gyro[:, c] = mean + std * np.convolve(noise, np.full(window, 1 / math.sqrt(window)), mode='valid')
+    time = np.arange(n) * dt
+
+    # True orientation from the gyro, global -> body rotation of gravity & the magnetic field
+    q = gyro_integration_parallel(IMURecording(time, gyro, np.zeros((n, 3)), np.zeros((n, 3))),
+                                  use_processes=False).q
+    q_inverse = quaternion_to_conjugate_batch(q)
+    # Sensor noise: the sample to sample variation of the real readings
+    accel_noise = np.diff(real.accel, axis=0).std(axis=0) / math.sqrt(2)
+    mag_noise = np.diff(real.mag, axis=0).std(axis=0) / math.sqrt(2)
+    accel = point_rotation_by_quaternion_batch(real.accel[0], q_inverse) + accel_noise * rng.standard_normal((n, 3))
+    mag = point_rotation_by_quaternion_batch(real.mag[0], q_inverse) + mag_noise * rng.standard_normal((n, 3))
+
+    # Hold each reading until the sensor's next update
+    for values, real_values in ((accel, real.accel), (mag, real.mag)):
+        interval = max(int(round(len(real_values) / np.count_nonzero(sensor_updates(real_values)))), 1)
+        values[:] = values[np.arange(n) // interval * interval]
+    return IMURecording(time, gyro, accel, mag)
+
+
+# Helper inputs
+def helper_inputs(n, seed=0):
+    """
+    :param n: batch size
+    :param seed: random seed
+    :return: dict of random inputs for the helpers: unit quaternions q1/q2 (n,4), vectors u/v (n,3),
+             unit vectors axis (n,3) & angles theta (n,)
+    """
+    rng = np.random.default_rng(seed)
+    q1, q2 = rng.standard_normal((2, n, 4))
+    axis = rng.standard_normal((n, 3))
+    return {'q1': q1 / np.linalg.norm(q1, axis=1, keepdims=True),
+            'q2': q2 / np.linalg.norm(q2, axis=1, keepdims=True),
+            'u': rng.standard_normal((n, 3)),
+            'v': rng.standard_normal((n, 3)),
+            'axis': axis / np.linalg.norm(axis, axis=1, keepdims=True),
+            'theta': rng.uniform(-math.pi, math.pi, n)}
+
+
+# Per-sample helpers
+HELPER_NAMES = ('convert_deg_to_rads', 'normalize', 'v_theta_to_quaternion', 'euler_to_quaternion',
+                'quaternion_to_euler', 'quaternion_to_conjugate', 'quaternion_product', 'angle_between_vectors',
+                'point_rotation_by_quaternion')
+
+
+def run_reference_helper(name, inputs):
+    """
+    Runs one of the per-sample helpers of helperFunctions.py over every row of the inputs
+    :param name: helper name, one of HELPER_NAMES
+    :param inputs: dict from helper_inputs
+    :return: list of outputs (XYZ lists for convert_deg_to_rads & normalize)
+    """
+    q1, q2 = inputs['q1'].tolist(), inputs['q2'].tolist()
+    u, v = inputs['u'].tolist(), inputs['v'].tolist()
+    if name == 'convert_deg_to_rads':
+        return convert_deg_to_rads(*inputs['u'].T.tolist())
+    if name == 'normalize':
+        return normalize(*inputs['u'].T.tolist())
+    if name == 'v_theta_to_quaternion':
+        return [v_theta_to_quaternion(a, t) for a, t in zip(inputs['axis'].tolist(), inputs['theta'].tolist())]
+    if name == 'euler_to_quaternion':
+        return [euler_to_quaternion(*e) for e in u]
+    if name == 'quaternion_to_euler':
+        return [quaternion_to_euler(q) for q in q1]
+    if name == 'quaternion_to_conjugate':
+        return [quaternion_to_conjugate(q) for q in q1]
+    if name == 'quaternion_product':
+        return [quaternion_product(a, b) for a, b in zip(q1, q2)]
+    if name == 'angle_between_vectors':
+        return [angle_between_vectors(a, b) for a, b in zip(u, v)]
+    if name == 'point_rotation_by_quaternion':
+        return [point_rotation_by_quaternion(a, q) for a, q in zip(u, q1)]
+    raise ValueError("Unknown helper '%s'" % name)
+
+
+def reference_helpers(inputs):
+    """
+    :param inputs: dict from helper_inputs
+    :return: dict, helper name -> output array, one row per input row
+    """
+    outputs = {}
+    for name in HELPER_NAMES:
+        out = np.array(run_reference_helper(name, inputs))
+        outputs[name] = out.T if name in ('convert_deg_to_rads', 'normalize') else out
+    return outputs
+
+
+# Optimized paths checked against the golden outputs
+def _multi_device(data):
+    tracker = MultiDeviceTracker(1, ALPHA, ALPHA_2, np.sqrt(np.sum(data.accel ** 2, axis=0)),
+                                 np.sqrt(np.sum(data.mag ** 2, axis=0)))
+    q = np.empty((len(data), 4))
+    for i in range(len(data)):
+        q[i] = tracker.step(data.time[i:i + 1], data.gyro[i:i + 1], data.accel[i:i + 1], data.mag[i:i + 1])[0]
+    return q
+
+
+def _resumed(data, kind):
+    """
+    Runs a filter to its middle checkpoint, then resumes from it over the second half
+    """
+    half = len(data) // 2
+    first, checkpoints = run_checkpointed(data, kind, ALPHA, ALPHA_2, every=half)
+    rest, _ = resume_from(checkpoints[0], data, every=len(data) + 1)
+    return np.vstack([first.q[:half], rest.q])
+
+
+FILTER_CHECKS = {
+    'gyro_integration': lambda data: {GYRO: gyro_integration(data, backend='python').q},
+    'drift_correction': lambda data: {TILT: drift_correction(data, ALPHA, backend='python').q},
+    'yaw_correction': lambda data: {YAW: yaw_correction(data, ALPHA, ALPHA_2, backend='python').q},
+    'engine.run_filters': lambda data: {k: r.q for k, r in run_filters(data, ALPHA, ALPHA_2, backend='python').items()},
+    'gyro_integration_parallel': lambda data: {GYRO: gyro_integration_parallel(data, 4, use_processes=False).q},
+    'streaming': lambda data: {k: run_checkpointed(data, k, ALPHA, ALPHA_2, every=len(data) + 1)[0].q
+                               for k in (GYRO, TILT, YAW)},
+    'checkpoint.resume': lambda data: {k: _resumed(data, k) for k in (GYRO, TILT, YAW)},
+    'multi_device': lambda data: {YAW: _multi_device(data)},
+}
+if jit_kernels.NUMBA_AVAILABLE:
+    FILTER_CHECKS.update({
+        'gyro_integration.numba': lambda data: {GYRO: gyro_integration(data, backend='numba').q},
+        'drift_correction.numba': lambda data: {TILT: drift_correction(data, ALPHA, backend='numba').q},
+        'yaw_correction.numba': lambda data: {YAW: yaw_correction(data, ALPHA, ALPHA_2, backend='numba').q},
+        'engine.run_filters.numba': lambda data: {k: r.q for k, r in
+                                                  run_filters(data, ALPHA, ALPHA_2, backend='numba').items()},
+    })
+
+HELPER_CHECKS = {
+    'convert_deg_to_rads': lambda h: np.radians(h['u']),
+    'normalize': lambda h: normalize_batch(h['u']),
+    'v_theta_to_quaternion': lambda h: v_theta_to_quaternion_batch(h['axis'], h['theta']),
+    'quaternion_to_euler': lambda h: quaternion_to_euler_batch(h['q1']),
+    'quaternion_to_conjugate': lambda h: quaternion_to_conjugate_batch(h['q1']),
+    'quaternion_product': lambda h: quaternion_product_batch(h['q1'], h['q2']),
+    'angle_between_vectors': lambda h: angle_between_vectors_batch(h['u'], h['v']),
+    'point_rotation_by_quaternion': lambda h: point_rotation_by_quaternion_batch(h['u'], h['q1']),
+}
+
+
+# Golden outputs
+def make_golden(path=GOLDEN_PATH, source='IMUData.csv', n=GOLDEN_SAMPLES):
+    """
+    Runs the reference implementations on a synthetic recording & random helper inputs and stores
+    inputs + outputs in an .npz file
+    :param path: output file
+    :param source: recording the synthetic data's statistics are taken from
+    :param n: number of samples
+    """
+    data = synthetic_recording(n, source)
+    inputs = helper_inputs(n)
+    golden = {'input.time': data.time, 'input.gyro': data.gyro, 'input.accel': data.accel, 'input.mag': data.mag}
+    golden.update({'helper_input.' + name: value for name, value in inputs.items()})
+    golden.update({'helper.' + name: value for name, value in reference_helpers(inputs).items()})
+    golden['filter.' + GYRO] = gyro_integration(data, backend='python').q
+    golden['filter.' + TILT] = drift_correction(data, ALPHA, backend='python').q
+    golden['filter.' + YAW] = yaw_correction(data, ALPHA, ALPHA_2, backend='python').q
+    # Plot data preparation: basis vectors rotated by each orientation
+    golden['plot.arrow_tips'] = np.array([[point_rotation_by_quaternion(list(b), q) for b in BASIS.tolist()]
+                                          for q in golden['filter.' + YAW].tolist()])
+    np.savez(path, **golden)
+
+
+def check_correctness(path=GOLDEN_PATH):
+    """
+    Compares every optimized path with the golden outputs
+    :param path: golden .npz file (see make_golden)
+    :return: list of (name, max abs error, passed)
+    """
+    with np.load(path) as f:
+        golden = dict(f)
+    data = IMURecording(golden['input.time'], golden['input.gyro'], golden['input.accel'], golden['input.mag'])
+    inputs = {name[len('helper_input.'):]: value for name, value in golden.items() if name.startswith('helper_input.')}
+
+    checks = []
+
+    def compare(name, actual, expected, tolerance):
+        error = float(np.max(np.abs(np.asarray(actual, dtype=float) - expected))) if len(expected) else 0.0
+        checks.append((name, error, bool(error <= tolerance)))
+
+    for name, run in FILTER_CHECKS.items():
+        for kind, q in run(IMURecording(data.time, data.gyro, data.accel, data.mag)).items():
+            compare('%s[%s]' % (name, kind), q, golden['filter.' + kind], FILTER_TOLERANCE)
+    for name, run in HELPER_CHECKS.items():
+        compare('helpers.%s' % name, run(inputs), golden['helper.' + name], HELPER_TOLERANCE)
+
+    result = OrientationResult(golden['filter.' + YAW])
+    compare('plot.euler', result.euler, np.array([quaternion_to_euler(q) for q in result.q.tolist()]),
+            HELPER_TOLERANCE)
+    segments = orientation_arrow_segments(result.q)
+    compare('plot.arrow_segments', segments[:, ::3, 0], golden['plot.arrow_tips'], HELPER_TOLERANCE)
+    return checks
+
+
+# Benchmark cases: name -> function(workload) run on each recording length
+def _fresh(data):
+    """
+    Copy of a recording without its cached conversions, so each run pays for them like a real one
+    """
+    return IMURecording(data.time, data.gyro, data.accel, data.mag)
+
+
+CASES = {}
+for _name in HELPER_NAMES:
+    CASES['helpers.' + _name] = (lambda name: lambda w: run_reference_helper(name, w['helpers']))(_name)
+for _name, _run in HELPER_CHECKS.items():
+    CASES['helpers.%s_batch' % _name] = (lambda run: lambda w: run(w['helpers']))(_run)
+CASES.update({
+    'gyro_integration': lambda w: gyro_integration(_fresh(w['data']), backend='python'),
+    'gyro_integration_parallel': lambda w: gyro_integration_parallel(_fresh(w['data'])),
+    'drift_correction': lambda w: drift_correction(_fresh(w['data']), ALPHA, backend='python'),
+    'yaw_correction': lambda w: yaw_correction(_fresh(w['data']), ALPHA, ALPHA_2, backend='python'),
+    'engine.run_filters': lambda w: run_filters(_fresh(w['data']), ALPHA, ALPHA_2, backend='python'),
+    'multirate_correction': lambda w: multirate_correction(_fresh(w['data']), ALPHA, ALPHA_2, backend='python'),
+    'adaptive_correction': lambda w: adaptive_correction(_fresh(w['data']), ALPHA, ALPHA_2),
+    'streaming.yaw': lambda w: run_checkpointed(_fresh(w['data']), YAW, ALPHA, ALPHA_2, every=len(w['data']) + 1),
+    'plot.euler': lambda w: OrientationResult(w['helpers']['q1']).euler_degrees,
+    'plot.arrow_segments': lambda w: orientation_arrow_segments(w['helpers']['q1']),
+    'plot.playback_frames': lambda w: playback_frames(w['data'].time, False, 20),
+    'plot.m4_decimation': lambda w: m4_indices(w['data'].time, list(w['helpers']['q1'].T), 2000),
+})
+if jit_kernels.NUMBA_AVAILABLE:
+    CASES.update({
+        'gyro_integration.numba': lambda w: gyro_integration(_fresh(w['data']), backend='numba'),
+        'drift_correction.numba': lambda w: drift_correction(_fresh(w['data']), ALPHA, backend='numba'),
+        'yaw_correction.numba': lambda w: yaw_correction(_fresh(w['data']), ALPHA, ALPHA_2, backend='numba'),
+        'engine.run_filters.numba': lambda w: run_filters(_fresh(w['data']), ALPHA, ALPHA_2, backend='numba'),
+        'engine.run_filters.numba_float32': lambda w: run_filters(_fresh(w['data']), ALPHA, ALPHA_2, backend='numba',
+                                                                  precision=np.float32),
+        'multirate_correction.numba': lambda w: multirate_correction(_fresh(w['data']), ALPHA, ALPHA_2, backend='numba'),
+    })
+del _name, _run
+
+
+def _measure(run, workload, repeat, memory):
+    """
+    :return: best time of `repeat` runs, s & peak memory allocated during one run (None if not measured)
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(workload)
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            run(workload)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, cases=None, repeat=3, memory=True, source='IMUData.csv', log=print):
+    """
+    Times each case at each recording length
+    :param sizes: recording lengths, samples
+    :param cases: case names to run (default: all of CASES)
+    :param repeat: runs per case, the fastest is kept
+    :param memory: also measure peak memory (one extra run under tracemalloc)
+    :param source: recording the synthetic data's statistics are taken from
+    :param log: function called with a line of progress per case (None = quiet)
+    :return: dict, case -> {size: {'seconds', 'samples_per_second', 'peak_bytes'} or {'error'}}
+    """
+    cases = list(CASES) if cases is None else cases
+    results = {name: {} for name in cases}
+    for n in sizes:
+        workload = {'data': synthetic_recording(n, source), 'helpers': helper_inputs(n)}
+        for name in cases:
+            try:
+                seconds, peak = _measure(CASES[name], workload, repeat, memory)
+            except (ArithmeticError, ValueError) as e:
+                # e.g. the uncorrected filters' orientations decay towards 0 over very long recordings
+                results[name][str(n)] = {'error': '%s: %s' % (type(e).__name__, e)}
+                if log:
+                    log("%-45s n=%-9d failed, %s" % (name, n, results[name][str(n)]['error']))
+                continue
+            results[name][str(n)] = {'seconds': seconds, 'samples_per_second': n / seconds if seconds else None,
+                                     'peak_bytes': peak}
+            if log:
+                log("%-45s n=%-9d %12.0f samples/s %s" % (name, n, n / seconds if seconds else float('inf'),
+                                                          '' if peak is None else '%8.1f MB peak' % (peak / 1e6)))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    """
+    Finds cases that got slower or use more memory than in the baseline
+    :param results: from run_benchmarks
+    :param baseline: results of an earlier run_benchmarks
+    :param tolerance: allowed relative slowdown / memory growth
+    :return: list of regression descriptions
+    """
+    regressions = []
+    for name, by_size in results.items():
+        for n, result in by_size.items():
+            base = baseline.get(name, {}).get(n)
+            if base is None or 'error' in base:
+                continue
+            if 'error' in result:
+                regressions.append("%s n=%s: %s" % (name, n, result['error']))
+                continue
+            if base['samples_per_second'] and result['samples_per_second'] and \
+                    result['samples_per_second'] < base['samples_per_second'] * (1 - tolerance):
+                regressions.append("%s n=%s: %.0f samples/s, baseline %.0f" % (
+                    name, n, result['samples_per_second'], base['samples_per_second']))
+            if base.get('peak_bytes') is not None and result['peak_bytes'] is not None and \
+                    result['peak_bytes'] > base['peak_bytes'] * (1 + tolerance) + MEMORY_SLACK:
+                regressions.append("%s n=%s: %.1f MB peak, baseline %.1f MB" % (
+                    name, n, result['peak_bytes'] / 1e6, base['peak_bytes'] / 1e6))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the orientation pipeline, gated on golden outputs")
+    parser.add_argument('--sizes', nargs='+', type=float, default=DEFAULT_SIZES,
+                        help="recording lengths, e.g. 1e3 1e7 (default: 1e3 1e4 1e5)")
+    parser.add_argument('--cases', nargs='+', help="only run cases whose name starts with one of these")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case, fastest is kept (default: 3)")
+    parser.add_argument('--no-memory', action='store_true', help="don't measure peak memory")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline JSON (default: %s)" % BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown / memory growth vs the baseline (default: 0.25)")
+    parser.add_argument('--golden', default=GOLDEN_PATH, help="golden outputs (default: %s)" % GOLDEN_PATH)
+    parser.add_argument('--update-golden', action='store_true', help="regenerate the golden outputs & exit")
+    parser.add_argument('--input', default='IMUData.csv', help="recording whose statistics the synthetic data follows")
+    parser.add_argument('-o', '--output', help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.update_golden:
+        make_golden(args.golden, args.input)
+        print("Wrote golden outputs to %s" % args.golden)
+        return 0
+
+    # Correctness first: timings of wrong results are worthless
+    checks = check_correctness(args.golden)
+    failed = [check for check in checks if not check[2]]
+    for name, error, passed in checks:
+        print("%-45s max error %.3g %s" % (name, error, 'ok' if passed else 'FAILED'))
+    if failed:
+        print("%d of %d paths differ from the golden outputs" % (len(failed), len(checks)))
+        return 1
+
+    cases = [name for name in CASES if args.cases is None or any(name.startswith(prefix) for prefix in args.cases)]
+    results = run_benchmarks([int(n) for n in args.sizes], cases, args.repeat, not args.no_memory, args.input)
+    report = {'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                          'platform': platform.platform(), 'processor': platform.processor()},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError):
+            baseline = {}
+        # Merge so baselines of cases / sizes not run this time are kept
+        for name, by_size in results.items():
+            baseline.setdefault(name, {}).update(by_size)
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(report, results=baseline), f, indent=2)
+        print("Saved baseline to %s" % args.baseline)
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    except OSError:
+        print("No baseline at %s, run with --save-baseline to create one" % args.baseline)
+        return 0
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
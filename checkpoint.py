@@ -0,0 +1,161 @@
+from collections import namedtuple
+import numpy as np
+from orientation_engine import GYRO, TILT, YAW
+from orientation_result import OrientationResult
+from streaming_filters import GyroIntegrator, TiltCorrector, YawCorrector
+
+# --- Checkpointed Filtering ---
+# Runs a filter (see streaming_filters.py) while saving a snapshot of its state every K samples. A
+# snapshot holds everything needed to carry on from that sample: the orientation, the last timestamp,
+# the yaw reference frame & the accel/magnet normalization. Filtering can then resume from the latest
+# checkpoint when data is appended to a recording, or from an earlier one with new alpha values,
+# instead of rerunning from sample 0.
+#
+# NB: the batch filters normalize by the whole recording, which changes when data is appended. Resumed
+# runs keep the normalization stored in the checkpoint, so results before the checkpoint stay valid.
+
+FilterCheckpoint = namedtuple('FilterCheckpoint', ['kind', 'index', 'time', 'q', 'q_ref', 'm_ref',
+                                                   'accel_scale', 'mag_scale', 'alpha', 'alpha_2'])
+FilterCheckpoint.__doc__ = """
+Filter state after processing sample index (of the full recording)
+"""
+
+
+# Build a streaming filter
+def _make_filter(kind, alpha, alpha_2, accel_scale, mag_scale):
+    if kind == GYRO:
+        return GyroIntegrator()
+    if kind == TILT:
+        return TiltCorrector(alpha, accel_scale)
+    if kind == YAW:
+        return YawCorrector(alpha, alpha_2, accel_scale, mag_scale)
+    raise ValueError("Unknown filter kind '%s'" % kind)
+
+
+# Snapshot a filter
+def _snapshot(kind, f, index, accel_scale, mag_scale, alpha, alpha_2):
+    return FilterCheckpoint(kind, index, f.last_time, f.q,
+                            getattr(f, 'q_ref', None), getattr(f, 'm_ref', None),
+                            accel_scale, mag_scale, alpha, alpha_2)
+
+
+# Run a filter from a given state
+def _run(kind, data, first_index, start, f, every, accel_scale, mag_scale, alpha, alpha_2, dtype):
+    """
+    Feeds samples data[start:] to filter f, snapshotting every `every` samples
+    :return: OrientationResult of data[start:], list of checkpoints
+    """
+    time = data.time[start:].tolist()
+    gyro = data.gyro[start:].tolist()
+    accel = data.accel[start:].tolist()
+    mag = data.mag[start:].tolist()
+
+    q = np.empty((len(time), 4), dtype=dtype)
+    checkpoints = []
+    update = f.update
+    for i in range(len(time)):
+        q[i] = update(time[i], gyro[i], accel[i], mag[i])
+        index = first_index + start + i
+        if (index + 1) % every == 0:
+            checkpoints.append(_snapshot(kind, f, index, accel_scale, mag_scale, alpha, alpha_2))
+    return OrientationResult(q, data.time[start:]), checkpoints
+
+
+# Run a filter with checkpoints
+def run_checkpointed(data, kind=YAW, alpha=0.05, alpha_2=0.00001, every=1000, accel_scale=None, mag_scale=None,
+                     dtype=np.float64):
+    """
+    Runs a filter over a recording from sample 0, saving a checkpoint every `every` samples. With the
+    default normalization results match gyro_integration / drift_correction / yaw_correction.
+    :param data: IMURecording
+    :param kind: GYRO, TILT or YAW
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param every: samples between checkpoints
+    :param accel_scale: per-axis accelerometer magnitudes (default: those of this recording)
+    :param mag_scale: per-axis magnetometer magnitudes (default: those of this recording)
+    :param dtype: dtype results are stored in
+    :return: OrientationResult, list of FilterCheckpoints
+    """
+    if accel_scale is None:
+        accel_scale = np.sqrt(np.sum(data.accel ** 2, axis=0))
+    if mag_scale is None:
+        mag_scale = np.sqrt(np.sum(data.mag ** 2, axis=0))
+    accel_scale, mag_scale = tuple(np.asarray(accel_scale).tolist()), tuple(np.asarray(mag_scale).tolist())
+    f = _make_filter(kind, alpha, alpha_2, accel_scale, mag_scale)
+    return _run(kind, data, 0, 0, f, every, accel_scale, mag_scale, alpha, alpha_2, dtype)
+
+
+# Resume a filter from a checkpoint
+def resume_from(checkpoint, data, first_index=0, alpha=None, alpha_2=None, every=1000, dtype=np.float64):
+    """
+    Carries on filtering after a checkpoint, e.g. over data appended to a recording, or from an earlier
+    checkpoint with new alpha values. Only samples after the checkpoint are processed.
+    :param checkpoint: FilterCheckpoint to resume from
+    :param data: IMURecording, either the full recording or just its newer samples
+    :param first_index: index (in the full recording) of data's first sample
+    :param alpha: new accelerometer gain (default: the checkpoint's)
+    :param alpha_2: new magnetometer gain (default: the checkpoint's)
+    :param every: samples between checkpoints
+    :param dtype: dtype results are stored in
+    :return: OrientationResult of the samples after the checkpoint, list of new FilterCheckpoints
+    """
+    start = checkpoint.index + 1 - first_index
+    if start < 0:
+        raise ValueError("data starts at sample %d, after checkpoint sample %d + 1" % (first_index, checkpoint.index))
+    alpha = checkpoint.alpha if alpha is None else alpha
+    alpha_2 = checkpoint.alpha_2 if alpha_2 is None else alpha_2
+
+    # Restore filter state
+    f = _make_filter(checkpoint.kind, alpha, alpha_2, checkpoint.accel_scale, checkpoint.mag_scale)
+    f.w, f.x, f.y, f.z = checkpoint.q
+    f.last_time = checkpoint.time
+    if checkpoint.kind == YAW:
+        f.set_reference(checkpoint.q_ref, checkpoint.m_ref)
+    return _run(checkpoint.kind, data, first_index, start, f, every, checkpoint.accel_scale, checkpoint.mag_scale,
+                alpha, alpha_2, dtype)
+
+
+# Pick a checkpoint
+def latest_checkpoint(checkpoints, before_time=None):
+    """
+    :param checkpoints: list of FilterCheckpoints (in sample order)
+    :param before_time: only consider checkpoints at or before this time, s (default: any)
+    :return: latest matching FilterCheckpoint, or None
+    """
+    for checkpoint in reversed(checkpoints):
+        if before_time is None or checkpoint.time <= before_time:
+            return checkpoint
+    return None
+
+
+# Save / load checkpoints
+def save_checkpoints(path, checkpoints):
+    """
+    Writes checkpoints to an .npz file
+    :param path: output file
+    :param checkpoints: list of FilterCheckpoints
+    """
+    columns = {}
+    for field in FilterCheckpoint._fields:
+        values = [getattr(checkpoint, field) for checkpoint in checkpoints]
+        if field in ('q_ref', 'm_ref', 'accel_scale', 'mag_scale'):
+            values = [np.full(4 if field == 'q_ref' else 3, np.nan) if v is None else v for v in values]
+        columns[field] = np.array(values)
+    np.savez(path, **columns)
+
+
+def load_checkpoints(path):
+    """
+    Reads checkpoints written by save_checkpoints
+    :param path: .npz file
+    :return: list of FilterCheckpoints
+    """
+    with np.load(path) as f:
+        columns = {field: f[field].tolist() for field in FilterCheckpoint._fields}
+    checkpoints = []
+    for values in zip(*[columns[field] for field in FilterCheckpoint._fields]):
+        values = [None if isinstance(v, list) and any(x != x for x in v) else
+                  tuple(v) if isinstance(v, list) else v for v in values]
+        checkpoints.append(FilterCheckpoint(*values))
+    return checkpoints
@@ -0,0 +1,88 @@
+import numpy as np
+
+# --- Plot Decimation ---
+# Long recordings have far more samples than a plot has pixels. M4 decimation splits the visible x
+# range into one bucket per pixel column and keeps only the first, last, min & max sample of each
+# bucket, which draws the same picture (spikes & drift included) from at most 4 points per pixel.
+
+
+# Indices kept by M4 decimation
+def m4_indices(x, ys, n_buckets, x_min=None, x_max=None):
+    """
+    Picks the first, last, min & max sample in each of n_buckets equal width buckets over [x_min, x_max]
+    :param x: (N,) sorted x values (e.g. time)
+    :param ys: list of (N,) y arrays, the min/max of each are kept
+    :param n_buckets: number of buckets (~ plot width in pixels)
+    :param x_min: start of visible range (default: x[0])
+    :param x_max: end of visible range (default: x[-1])
+    :return: sorted array of indices to plot (includes one sample either side of the range)
+    """
+    x = np.asarray(x)
+    if len(x) == 0:
+        return np.zeros(0, dtype=np.intp)
+    x_min = x[0] if x_min is None else x_min
+    x_max = x[-1] if x_max is None else x_max
+
+    # Visible samples + one either side so lines run off the edge of the plot
+    start = max(int(np.searchsorted(x, x_min, side='left')) - 1, 0)
+    stop = min(int(np.searchsorted(x, x_max, side='right')) + 1, len(x))
+    if stop - start <= 4 * n_buckets:
+        return np.arange(start, stop)
+
+    # Bucket boundaries (as sample indices)
+    edges = np.searchsorted(x[start:stop], np.linspace(x_min, x_max, n_buckets + 1)[1:-1]) + start
+    edges = np.unique(np.concatenate([[start], edges, [stop]]))
+    first = edges[:-1]
+    last = edges[1:] - 1
+    keep = [first, last]
+    for y in ys:
+        y = np.asarray(y)[start:stop]
+        offsets = first - start
+        keep.append(_segment_extreme(y, offsets, np.fmin) + start)
+        keep.append(_segment_extreme(y, offsets, np.fmax) + start)
+    return np.unique(np.concatenate(keep))
+
+
+# Index of the min/max of each segment of y
+def _segment_extreme(y, offsets, reduce):
+    """
+    Finds the (first) index of the min/max in each segment y[offsets[i]:offsets[i+1]]
+    :param y: (n,) values
+    :param offsets: (B,) sorted segment starts, offsets[0] = 0
+    :param reduce: np.fmin or np.fmax (NaNs are ignored)
+    :return: (B,) indices into y
+    """
+    counts = np.diff(np.append(offsets, len(y)))
+    extreme = reduce.reduceat(y, offsets)
+    hits = np.flatnonzero(y == np.repeat(extreme, counts))
+    # First hit at/after each segment start; segments that are all NaN fall back to their first sample
+    found = np.searchsorted(hits, offsets)
+    idx = hits[np.minimum(found, len(hits) - 1)] if len(hits) else offsets
+    return np.where((idx >= offsets) & (idx < offsets + counts), idx, offsets)
+
+
+# Plot lines with decimation that follows zoom & pan
+def plot_decimated(ax, x, ys, fmt='-'):
+    """
+    Plots each y in ys against x on ax, drawing only the M4 decimated samples for the visible x range.
+    The lines are re-decimated whenever the x limits change (zoom/pan), so detail appears as you zoom in.
+    :param ax: matplotlib axes
+    :param x: (N,) sorted x values (e.g. time)
+    :param ys: list of (N,) y arrays
+    :param fmt: line format
+    :return: list of Line2D, one per y
+    """
+    x = np.asarray(x)
+    ys = [np.asarray(y) for y in ys]
+    n_buckets = max(int(ax.bbox.width), 1)
+    idx = m4_indices(x, ys, n_buckets)
+    lines = [ax.plot(x[idx], y[idx], fmt)[0] for y in ys]
+
+    def redecimate(ax):
+        x_min, x_max = ax.get_xlim()
+        idx = m4_indices(x, ys, max(int(ax.bbox.width), 1), x_min, x_max)
+        for line, y in zip(lines, ys):
+            line.set_data(x[idx], y[idx])
+
+    ax.callbacks.connect('xlim_changed', redecimate)
+    return lines
@@ -1,47 +1,65 @@
-import pandas as pd
+from time import perf_counter
 from helperFunctions import *
+import instrumentation
+import jit_kernels
+from orientation_result import OrientationResult
 
 
 # Drift correction
-def drift_correction(alpha):
-    # Import data from CSV
-    data = pd.read_csv("IMUData.csv")
+def drift_correction(data, alpha, dtype=np.float64, backend='auto'):
+    """
+    Gyro integration + pitch & roll drift correction from the accelerometer
+    :param data: IMURecording (see imu_data.load_recording)
+    :param alpha: accelerometer gain
+    :param dtype: dtype results are stored in (float64 or float32)
+    :param backend: 'auto' (compiled kernel if numba is installed), 'numba' or 'python'
+    :return: OrientationResult, (N,4) orientations wxyz
+    """
+    if jit_kernels.use_jit(backend):
+        with instrumentation.stage('drift_correction.kernel', len(data)):
+            q = jit_kernels.run_kernel(data, jit_kernels.TILT_MODE, alpha, dtype=dtype)
+        return OrientationResult(q, data.time)
 
-    # Columns are: (Gyroscope) X, Y, Z | (Accelerometer) X, Y, Z | (Magnetometer) X, Y, Z
-    # Vals init in deg / s (Gyroscope), m / s^2 (accelerometer), G [gauss] (magnetometer)
-    time = data['time'].tolist()
-    gyro_X = data['gyroscope.X'].tolist()
-    gyro_Y = data['gyroscope.Y'].tolist()
-    gyro_Z = data['gyroscope.Z'].tolist()
-    accel_X = data['accelerometer.X'].tolist()
-    accel_Y = data['accelerometer.Y'].tolist()
-    accel_Z = data['accelerometer.Z'].tolist()
-
-    # Convert gyro data (angular velocity) : deg/s -> rad/s
-    gyro_X, gyro_Y, gyro_Z = convert_deg_to_rads(gyro_X, gyro_Y, gyro_Z)
-
-    # Normalize accel & magnet data
-    accel_X, accel_Y, accel_Z = normalize(accel_X, accel_Y, accel_Z)
+    # Data is pre-converted once per recording: gyro -> rad/s, accel & magnet -> normalized
+    time = data.time.tolist()
+    gyro_X, gyro_Y, gyro_Z = data.gyro_rads.T.tolist()
+    accel_X, accel_Y, accel_Z = data.accel_normalized.T.tolist()
 
     # init orientation = identity quaternion : [w, x, y, z]
-    q = [[1, 0, 0, 0]]
+    q = np.empty((len(time), 4), dtype=dtype)
+    q[0] = q_prev = [1, 0, 0, 0]
+
+    # Per-step timers, only run while profiling (see instrumentation.py)
+    timed = instrumentation.enabled()
+    gyro_time = tilt_time = 0.0
 
     # Start @ t=1 as @ t=0, orientation = [1,0,0,0]
     for i in range(1, len(gyro_X)):
+        if timed:
+            tic = perf_counter()
+
         # --- Gyro Integration (Gyroscope) ---
 
         # Calc l, magnitude of gyro reading
         l = math.sqrt(gyro_X[i] ** 2 + gyro_Y[i] ** 2 + gyro_Z[i] ** 2)
-        # Calc v_xyz, normalized gyro readings
-        v_x = gyro_X[i] / l
-        v_y = gyro_Y[i] / l
-        v_z = gyro_Z[i] / l
+        # Calc v_xyz, normalized gyro readings (0 reading = no rotation)
+        if l == 0:
+            v_x = v_y = v_z = 0.0
+        else:
+            v_x = gyro_X[i] / l
+            v_y = gyro_Y[i] / l
+            v_z = gyro_Z[i] / l
         # Calc theta
         theta = l * (time[i] - time[i - 1])
         # Calc quaternion
         w, x, y, z = v_theta_to_quaternion([v_x, v_y, v_z], theta)
         # Calc new q val
-        q_new = quaternion_product(q[-1], [w, x, y, z])
+        q_new = quaternion_product(q_prev, [w, x, y, z])
+
+        if timed:
+            toc = perf_counter()
+            gyro_time += toc - tic
+            tic = toc
 
         # --- Pitch & Roll Drift Correction (Accelerometer) ---
 
@@ -59,6 +77,11 @@ def drift_correction(alpha):
         # Correct for drift
         q_new = quaternion_product(q_new, [w, x, y, z])
 
-        q.append(q_new)
+        if timed:
+            tilt_time += perf_counter() - tic
+        q[i] = q_prev = q_new
+
+    instrumentation.record('drift_correction.gyro_step', gyro_time, len(time) - 1)
+    instrumentation.record('drift_correction.tilt_step', tilt_time, len(time) - 1)
 
-    return q
+    return OrientationResult(q, data.time)
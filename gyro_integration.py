@@ -1,42 +1,150 @@
-import pandas as pd
+import os
+from time import perf_counter
 from helperFunctions import *
+import instrumentation
+import jit_kernels
+from orientation_result import OrientationResult
 
 
 # Gyro Integration
-def gyro_integration():
-    # Import data from CSV
-    data = pd.read_csv("IMUData.csv")
+def gyro_integration(data, dtype=np.float64, backend='auto'):
+    """
+    Integrates gyroscope readings into orientations
+    :param data: IMURecording (see imu_data.load_recording)
+    :param dtype: dtype results are stored in (float64 or float32)
+    :param backend: 'auto' (compiled kernel if numba is installed), 'numba' or 'python'
+    :return: OrientationResult, (N,4) orientations wxyz
+    """
+    if jit_kernels.use_jit(backend):
+        with instrumentation.stage('gyro_integration.kernel', len(data)):
+            q = jit_kernels.run_kernel(data, jit_kernels.GYRO_MODE, dtype=dtype)
+        return OrientationResult(q, data.time)
 
-    # Columns are: (Gyroscope) X, Y, Z | (Accelerometer) X, Y, Z | (Magnetometer) X, Y, Z
-    # Vals init in deg / s (Gyroscope), m / s^2 (accelerometer), G [gauss] (magnetometer)
-    time = data['time'].tolist()
-    gyro_X = data['gyroscope.X'].tolist()
-    gyro_Y = data['gyroscope.Y'].tolist()
-    gyro_Z = data['gyroscope.Z'].tolist()
-
-    # Convert gyro data (angular velocity) : deg/s -> rad/s
-    gyro_X, gyro_Y, gyro_Z = convert_deg_to_rads(gyro_X, gyro_Y, gyro_Z)
+    # Data is pre-converted once per recording: gyro -> rad/s, accel & magnet -> normalized
+    time = data.time.tolist()
+    gyro_X, gyro_Y, gyro_Z = data.gyro_rads.T.tolist()
 
     # init orientation = identity quaternion : [w, x, y, z]
-    q = [[1, 0, 0, 0]]
+    q = np.empty((len(time), 4), dtype=dtype)
+    q[0] = q_prev = [1, 0, 0, 0]
+
+    # Per-step timers, only run while profiling (see instrumentation.py)
+    timed = instrumentation.enabled()
+    gyro_time = 0.0
 
     # Start @ t=1 as @ t=0, orientation = [1,0,0,0]
     for i in range(1, len(gyro_X)):
+        if timed:
+            tic = perf_counter()
+
         # --- Gyro Integration (Gyroscope) ---
 
         # Calc l, magnitude of gyro reading
         l = math.sqrt(gyro_X[i] ** 2 + gyro_Y[i] ** 2 + gyro_Z[i] ** 2)
-        # Calc v_xyz, normalized gyro readings
-        v_x = gyro_X[i] / l
-        v_y = gyro_Y[i] / l
-        v_z = gyro_Z[i] / l
+        # Calc v_xyz, normalized gyro readings (0 reading = no rotation)
+        if l == 0:
+            v_x = v_y = v_z = 0.0
+        else:
+            v_x = gyro_X[i] / l
+            v_y = gyro_Y[i] / l
+            v_z = gyro_Z[i] / l
         # Calc theta
         theta = l * (time[i] - time[i - 1])
         # Calc quaternion
         w, x, y, z = v_theta_to_quaternion([v_x, v_y, v_z], theta)
         # Calc new q val
-        q_new = quaternion_product(q[-1], [w, x, y, z])
+        q_new = quaternion_product(q_prev, [w, x, y, z])
+
+        if timed:
+            gyro_time += perf_counter() - tic
+        q[i] = q_prev = q_new
+
+    instrumentation.record('gyro_integration.gyro_step', gyro_time, len(time) - 1)
+
+    return OrientationResult(q, data.time)
+
+
+# --- Parallel Gyro Integration ---
+# Gyro integration has no sensor feedback: q[i] = q[i-1] * dq[i] = dq[1] * ... * dq[i]. As the
+# quaternion product is associative this is a prefix scan, so the samples can be split into chunks,
+# scanned independently and then joined by multiplying each chunk by the product of all chunks
+# before it.
+
+
+# Inclusive prefix product of a chunk of quaternions
+def _chunk_prefix(dq):
+    """
+    Calculates the running quaternion product of dq. The chunk is split into ~sqrt(n) blocks which
+    are scanned side by side (vectorized across blocks), then each block is rotated by the product
+    of the blocks before it.
+    :param dq: (n,4) array of quaternions
+    :return: (n,4) array, row i = dq[0] * ... * dq[i]
+    """
+    n = len(dq)
+    if n <= 64:
+        prefix = np.array(dq, dtype=float)
+        for i in range(1, n):
+            prefix[i] = quaternion_product(prefix[i - 1], prefix[i])
+        return prefix
+
+    # Pad with identity quaternions to fill (n_blocks, block_size)
+    block_size = int(math.ceil(math.sqrt(n)))
+    n_blocks = -(-n // block_size)
+    blocks = np.zeros((n_blocks * block_size, 4))
+    blocks[:, 0] = 1
+    blocks[:n] = dq
+    blocks = blocks.reshape(n_blocks, block_size, 4)
+
+    # Scan within blocks
+    for j in range(1, block_size):
+        blocks[:, j] = quaternion_product_batch(blocks[:, j - 1], blocks[:, j])
+
+    # Rotate each block by the product of all previous blocks
+    carry = _chunk_prefix(blocks[:, -1])
+    blocks[1:] = quaternion_product_batch(carry[:-1, None, :], blocks[1:])
+
+    return blocks.reshape(-1, 4)[:n]
+
+
+# Gyro Integration (parallel prefix scan)
+def gyro_integration_parallel(data, workers=None, chunk_size=None, use_processes=True):
+    """
+    Integrates gyroscope readings into orientations, splitting the work across a process/thread pool.
+    Matches gyro_integration within floating point tolerance; orientations are renormalized at chunk
+    boundaries.
+    :param data: IMURecording (see imu_data.load_recording)
+    :param workers: number of workers (default: number of CPUs)
+    :param chunk_size: samples per chunk (default: split evenly between workers)
+    :param use_processes: T = process pool, F = thread pool
+    :return: OrientationResult, (N,4) orientations wxyz
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from orientation_engine import gyro_delta_quaternions
+
+    workers = workers or os.cpu_count() or 1
+    dq = gyro_delta_quaternions(data)
+    n = len(dq) - 1
+    if chunk_size is None:
+        chunk_size = max(1, -(-n // workers))
+    chunks = [dq[start:start + chunk_size] for start in range(1, len(dq), chunk_size)]
+
+    # Scan each chunk independently
+    if workers > 1 and len(chunks) > 1:
+        pool = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with pool(max_workers=workers) as executor:
+            prefixes = list(executor.map(_chunk_prefix, chunks))
+    else:
+        prefixes = [_chunk_prefix(chunk) for chunk in chunks]
 
-        q.append(q_new)
+    # Join chunks: each chunk is rotated by the (renormalized) orientation at the end of the last one
+    q = np.empty((len(dq), 4))
+    q[0] = [1, 0, 0, 0]
+    start = 1
+    for prefix in prefixes:
+        carry = q[start - 1]
+        q[start:start + len(prefix)] = quaternion_product_batch(carry, prefix)
+        end = start + len(prefix) - 1
+        q[end] /= np.sqrt(np.sum(q[end] ** 2))
+        start = end + 1
 
-    return q
+    return OrientationResult(q, data.time)
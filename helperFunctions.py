@@ -181,3 +181,138 @@ def point_rotation_by_quaternion(v, q):
     q_conj = [q[0], -q[1], -q[2], -q[3]]
     return quaternion_product(quaternion_product(q, r), q_conj)[1:]
 
+
+
+# --- Batched Helper Functions (NumPy) ----
+# Array equivalents of the functions above: quaternions are (N,4) arrays (wxyz), vectors are (N,3)
+# arrays (xyz). A single quaternion/vector of shape (4,)/(3,) broadcasts against a batch.
+# float32 arrays are computed in float32, anything else in float64.
+
+
+# Array of floats (batched)
+def _float_array(a):
+    """
+    :param a: array like
+    :return: a as an array, float32 if it already is float32, float64 otherwise
+    """
+    a = np.asarray(a)
+    return a if a.dtype == np.float32 else a.astype(np.float64, copy=False)
+
+
+# Normalize Vectors (batched)
+def normalize_batch(V):
+    """
+    Normalizes each column of V (i.e. the X, Y & Z vectors passed to normalize). In the case of a
+    column with 0 magnitude, to avoid NaN errors, the 0 vector is simply returned.
+    :param V: (N,3) array, columns XYZ
+    :return: (N,3) array with normalized columns XYZ
+    """
+    V = np.asarray(V, dtype=float)
+    mag = np.sqrt(np.sum(V ** 2, axis=0))
+    return np.divide(V, mag, out=np.zeros_like(V), where=mag != 0)
+
+
+# Quaternion Product A * B (batched)
+def quaternion_product_batch(q1, q2):
+    """
+    Returns the quaternion products of two arrays of quaternions
+    :param q1: quaternions q1, (N,4) wxyz
+    :param q2: quaternions q2, (N,4) wxyz
+    :return: quaternion products q1 * q2, (N,4) wxyz
+    """
+    q1 = _float_array(q1)
+    q2 = _float_array(q2)
+    Wa, Xa, Ya, Za = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    Wb, Xb, Yb, Zb = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+    out = np.empty(np.broadcast(Wa, Wb).shape + (4,), dtype=np.result_type(q1, q2))
+    out[..., 1] = Xa * Wb + Ya * Zb - Za * Yb + Wa * Xb
+    out[..., 2] = -Xa * Zb + Ya * Wb + Za * Xb + Wa * Yb
+    out[..., 3] = Xa * Yb - Ya * Xb + Za * Wb + Wa * Zb
+    out[..., 0] = -Xa * Xb - Ya * Yb - Za * Zb + Wa * Wb
+    return out
+
+
+# Quaternion to conjugate (batched)
+def quaternion_to_conjugate_batch(q):
+    """
+    Calculates conjugates of an array of quaternions
+    :param q: quaternions, (N,4) wxyz
+    :return: quaternion conjugates, (N,4) wxyz
+    """
+    q_conj = -_float_array(q)
+    q_conj[..., 0] *= -1
+    return q_conj
+
+
+# Convert V & Theta angles to Quaternions (batched)
+def v_theta_to_quaternion_batch(v, theta):
+    """
+    Converts normalized vectors v and angles of rotation theta into quaternion format
+    :param v: normalized 3d vectors, (N,3) xyz
+    :param theta: angles of rotation, (N,) rads
+    :return: quaternion equivalents of v, theta -> (N,4) wxyz
+    """
+    v = _float_array(v)
+    half_theta = _float_array(theta) / 2
+    s = np.sin(half_theta)
+    out = np.empty(np.broadcast(v[..., 0], half_theta).shape + (4,), dtype=np.result_type(v, half_theta))
+    out[..., 0] = np.cos(half_theta)
+    out[..., 1] = v[..., 0] * s
+    out[..., 2] = v[..., 1] * s
+    out[..., 3] = v[..., 2] * s
+    return out
+
+
+# Convert Quaternion to Euler (batched, assumes quaternions are normalized)
+def quaternion_to_euler_batch(q):
+    """
+    Converts an array of quaternions wxyz into euler format xyz
+    :param q: quaternions, (N,4) wxyz
+    :return: euler representations, (N,3) xyz (roll, pitch, yaw)
+    """
+    q = np.asarray(q, dtype=float)
+    W, X, Y, Z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    out = np.empty(q.shape[:-1] + (3,), dtype=q.dtype)
+
+    # roll(x - axis rotation)
+    out[..., 0] = np.arctan2(2.0 * (W * X + Y * Z), 1.0 - 2.0 * (X * X + Y * Y))
+
+    # pitch(y - axis rotation), use 90 degrees if out of range
+    sinp = 2.0 * (W * Y - Z * X)
+    out[..., 1] = np.where(np.abs(sinp) >= 1, np.copysign(math.pi / 2, sinp),
+                           np.arcsin(np.clip(sinp, -1, 1)))
+
+    # yaw(z - axis rotation)
+    out[..., 2] = np.arctan2(2.0 * (W * Z + X * Y), 1.0 - 2.0 * (Y * Y + Z * Z))
+
+    return out
+
+
+# Calcs angle between two 3D vectors (batched)
+def angle_between_vectors_batch(u, v):
+    """
+    Returns angles between two arrays of 3d vectors
+    :param u: 3d vectors, (N,3)
+    :param v: 3d vectors, (N,3)
+    :return: angles between each pair of vectors, (N,)
+    """
+    u = _float_array(u)
+    v = _float_array(v)
+    mag_u = np.sqrt(u[..., 0]**2 + u[..., 1]**2 + u[..., 2]**2)
+    mag_v = np.sqrt(v[..., 0]**2 + v[..., 1]**2 + v[..., 2]**2)
+    dot_prod = u[..., 0] * v[..., 0] + u[..., 1] * v[..., 1] + u[..., 2] * v[..., 2]
+    return np.arccos(dot_prod / (mag_u * mag_v))
+
+
+# Rotates xyz vectors by quaternions wxyz (batched)
+def point_rotation_by_quaternion_batch(v, q):
+    """
+    Rotates vectors xyz by quaternions wxyz
+    :param v: 3d vectors, (N,3) xyz
+    :param q: quaternions, (N,4) wxyz
+    :return: new orientations of vectors, (N,3) xyz
+    """
+    v = _float_array(v)
+    r = np.zeros(v.shape[:-1] + (4,), dtype=v.dtype)
+    r[..., 1:] = v
+    return quaternion_product_batch(quaternion_product_batch(q, r), quaternion_to_conjugate_batch(q))[..., 1:]
@@ -0,0 +1,130 @@
+import os
+import numpy as np
+from helperFunctions import normalize_batch
+import instrumentation
+
+# --- IMU Data Loading ---
+
+# Columns are: time | (Gyroscope) X, Y, Z | (Accelerometer) X, Y, Z | (Magnetometer) X, Y, Z
+# Vals in deg / s (Gyroscope), m / s^2 (accelerometer), G [gauss] (magnetometer)
+CSV_COLUMNS = ['time',
+               'gyroscope.X', 'gyroscope.Y', 'gyroscope.Z',
+               'accelerometer.X', 'accelerometer.Y', 'accelerometer.Z',
+               'magnetometer.X', 'magnetometer.Y', 'magnetometer.Z']
+
+# Binary copy of the CSV written next to it, e.g. IMUData.csv -> IMUData.csv.cache.npz
+CACHE_SUFFIX = '.cache.npz'
+
+
+class IMURecording:
+    """
+    A single IMU recording held as float64 arrays: time (N,), gyro, accel & mag (N,3), contiguous unless
+    they are views of a memory mapped trace (see imu_trace.py).
+    The values filters need (gyro in rad/s, normalized accel & mag) are computed once on first use.
+    """
+
+    def __init__(self, time, gyro, accel, mag, contiguous=True):
+        """
+        :param time: (N,) timestamps, s
+        :param gyro: (N,3) gyroscope XYZ, deg/s
+        :param accel: (N,3) accelerometer XYZ, m/s^2
+        :param mag: (N,3) magnetometer XYZ, G
+        :param contiguous: F = keep arrays that are already float64 as they are (e.g. memory mapped
+                           columns) rather than copying them into contiguous ones
+        """
+        as_array = np.ascontiguousarray if contiguous else np.asarray
+        self.time = as_array(time, dtype=np.float64)
+        self.gyro = as_array(gyro, dtype=np.float64)
+        self.accel = as_array(accel, dtype=np.float64)
+        self.mag = as_array(mag, dtype=np.float64)
+        self._gyro_rads = None
+        self._accel_normalized = None
+        self._mag_normalized = None
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def gyro_rads(self):
+        """
+        Gyro data (angular velocity) converted deg/s -> rad/s
+        """
+        if self._gyro_rads is None:
+            with instrumentation.stage('load.convert_deg_to_rads', len(self)):
+                self._gyro_rads = np.radians(self.gyro)
+        return self._gyro_rads
+
+    @property
+    def accel_normalized(self):
+        """
+        Accelerometer data, each axis normalized over the whole recording (see normalize)
+        """
+        if self._accel_normalized is None:
+            with instrumentation.stage('load.normalize', len(self)):
+                self._accel_normalized = normalize_batch(self.accel)
+        return self._accel_normalized
+
+    @property
+    def mag_normalized(self):
+        """
+        Magnetometer data, each axis normalized over the whole recording (see normalize)
+        """
+        if self._mag_normalized is None:
+            with instrumentation.stage('load.normalize', len(self)):
+                self._mag_normalized = normalize_batch(self.mag)
+        return self._mag_normalized
+
+
+# Read CSV into columns
+def _parse_csv(path):
+    """
+    Parses an IMU CSV file
+    :param path: path to CSV
+    :return: (N,10) float64 array, columns as CSV_COLUMNS
+    """
+    import pandas as pd
+    with instrumentation.stage('load.csv_parse'):
+        data = pd.read_csv(path, usecols=CSV_COLUMNS)
+        return data[CSV_COLUMNS].to_numpy(dtype=np.float64)
+
+
+# Load IMU data (from binary cache if up to date)
+def load_recording(path="IMUData.csv", use_cache=True):
+    """
+    Loads an IMU CSV into an IMURecording. Parsed data is cached in a binary sidecar file keyed by
+    the CSV's mtime and size, so repeat loads of an unchanged file skip CSV parsing.
+    .imut traces (see imu_trace.py) are read through a memory map instead, without copying float64
+    traces into memory.
+    :param path: path to CSV or .imut trace
+    :param use_cache: read/write the binary sidecar (CSV only)
+    :return: IMURecording
+    """
+    if path.endswith('.imut'):
+        from imu_trace import open_trace
+        return open_trace(path).recording()
+
+    stat = os.stat(path)
+    key = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    cache_path = path + CACHE_SUFFIX
+
+    columns = None
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with instrumentation.stage('load.cache_read'), np.load(cache_path) as cached:
+                if np.array_equal(cached['key'], key):
+                    columns = cached['columns']
+        except (OSError, ValueError, KeyError):
+            columns = None
+
+    if columns is None:
+        columns = _parse_csv(path)
+        if use_cache:
+            # Write to a temp file first so a partially written cache is never read
+            tmp_path = cache_path + '.tmp.npz'
+            try:
+                np.savez(tmp_path, key=key, columns=columns)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                pass
+
+    return IMURecording(columns[:, 0], columns[:, 1:4], columns[:, 4:7], columns[:, 7:10])
@@ -0,0 +1,153 @@
+import argparse
+import struct
+import sys
+import numpy as np
+from imu_data import CSV_COLUMNS, IMURecording
+
+# --- Binary IMU Trace Format (.imut) ---
+# A fixed-width binary copy of an IMU recording that can be opened with numpy.memmap, so opening even
+# a multi-GB trace reads nothing but the header, and a time window can be sliced without reading the
+# rest of the file.
+#
+# Layout (little endian):
+#   8s  magic b'IMUTRACE'
+#   H   version (1)
+#   H   number of columns, C
+#   4s  numpy dtype of the records, b'<f4' or b'<f8' (space padded)
+#   I   data offset, bytes from the start of the file (multiple of 64)
+#   column names, utf-8, '\n' separated, zero padded up to the data offset
+#   records: one row of C values per sample (time, gyroscope.XYZ, accelerometer.XYZ, magnetometer.XYZ)
+
+TRACE_MAGIC = b'IMUTRACE'
+TRACE_VERSION = 1
+TRACE_SUFFIX = '.imut'
+_HEADER = struct.Struct('<8sHH4sI')
+
+
+class IMUTrace:
+    """
+    A memory mapped .imut trace. Columns are read from disk only when they are used.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: .imut file
+        """
+        with open(path, 'rb') as f:
+            magic, version, n_columns, dtype, offset = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != TRACE_MAGIC:
+                raise ValueError("%s is not an IMU trace" % path)
+            if version != TRACE_VERSION:
+                raise ValueError("Unsupported IMU trace version %d" % version)
+            names = f.read(offset - _HEADER.size).rstrip(b'\0').decode('utf-8')
+        self.path = path
+        self.columns = names.split('\n')
+        if len(self.columns) != n_columns:
+            raise ValueError("Corrupt IMU trace header: %d column names for %d columns" % (len(self.columns), n_columns))
+        missing = [column for column in CSV_COLUMNS if column not in self.columns]
+        if missing:
+            raise ValueError("IMU trace is missing columns: %s" % ", ".join(missing))
+        self.dtype = np.dtype(dtype.decode('ascii').strip())
+        # (N, C) view of the records, nothing is read until it is indexed
+        self.data = np.memmap(path, dtype=self.dtype, mode='r', offset=offset).reshape(-1, n_columns)
+        self._index = [self.columns.index(column) for column in CSV_COLUMNS]
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def time(self):
+        """
+        (N,) timestamps (memory mapped)
+        """
+        return self.data[:, self._index[0]]
+
+    def _columns(self, rows, first, n):
+        """
+        CSV_COLUMNS[first:first + n] of rows, as a view if they are stored side by side
+        """
+        index = self._index[first:first + n]
+        if index == list(range(index[0], index[0] + n)):
+            return rows[:, index[0]:index[0] + n]
+        return rows[:, index]
+
+    def recording(self, start=None, stop=None, copy=False):
+        """
+        Samples [start, stop) as an IMURecording. By default the columns of a float64 trace stay memory
+        mapped views, so records are only read from disk as they are used (float32 traces are converted,
+        which reads them).
+        :param start: first sample
+        :param stop: end sample (exclusive)
+        :param copy: T = read the samples into contiguous in-memory arrays
+        :return: IMURecording
+        """
+        rows = self.data[start:stop]
+        return IMURecording(rows[:, self._index[0]], self._columns(rows, 1, 3), self._columns(rows, 4, 3),
+                            self._columns(rows, 7, 3), contiguous=copy)
+
+    def window(self, t_start, t_end):
+        """
+        Reads the samples with t_start <= time < t_end into memory (binary search on the memory mapped
+        time column)
+        :param t_start: s
+        :param t_end: s
+        :return: IMURecording
+        """
+        time = self.time
+        start = int(np.searchsorted(time, t_start, side='left'))
+        stop = int(np.searchsorted(time, t_end, side='left'))
+        return self.recording(start, stop, copy=True)
+
+
+# Open a trace
+def open_trace(path):
+    """
+    :param path: .imut file
+    :return: IMUTrace
+    """
+    return IMUTrace(path)
+
+
+# Convert IMU CSV -> trace
+def convert_csv_to_trace(csv_path, trace_path, dtype=np.float64, chunksize=100000):
+    """
+    Converts an IMU CSV (IMUData.csv schema) into an .imut trace, chunk by chunk (constant memory)
+    :param csv_path: IMU CSV file
+    :param trace_path: output .imut file
+    :param dtype: record dtype, float64 or float32
+    :param chunksize: CSV rows per chunk
+    :return: number of samples written
+    """
+    from streaming_ingest import iter_chunks
+
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if dtype not in (np.dtype('<f4'), np.dtype('<f8')):
+        raise ValueError("IMU traces store float32 or float64 records, not %s" % dtype)
+    names = '\n'.join(CSV_COLUMNS).encode('utf-8')
+    offset = -(-(_HEADER.size + len(names)) // 64) * 64
+
+    n_samples = 0
+    with open(trace_path, 'wb') as f:
+        f.write(_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, len(CSV_COLUMNS), dtype.str.encode('ascii').ljust(4), offset))
+        f.write(names.ljust(offset - _HEADER.size, b'\0'))
+        for chunk in iter_chunks(csv_path, chunksize):
+            f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+            n_samples += len(chunk)
+    return n_samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert an IMU CSV into a memory mappable .imut trace")
+    parser.add_argument('csv', help="IMU CSV file")
+    parser.add_argument('trace', nargs='?', help="output trace (default: CSV name with .imut extension)")
+    parser.add_argument('--float32', action='store_true', help="store float32 records (default: float64)")
+    args = parser.parse_args(argv)
+
+    trace = args.trace or args.csv.rsplit('.', 1)[0] + TRACE_SUFFIX
+    n = convert_csv_to_trace(args.csv, trace, np.float32 if args.float32 else np.float64)
+    print("Wrote %d samples to %s" % (n, trace))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
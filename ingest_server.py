@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import json
+import math
+import socket
+import sys
+from collections import deque
+from time import perf_counter
+from imu_data import CSV_COLUMNS
+from streaming_filters import YawCorrector
+from streaming_ingest import column_scales
+
+# --- Network Ingest Server ---
+# Filters live IMU streams sent over the network with the yaw corrected filter (see
+# streaming_filters.YawCorrector) and publishes the orientations to subscribers.
+#
+# Ingest (UDP & TCP, same port): text lines of the ten IMUData.csv fields, i.e.
+#   time,gyro X,Y,Z,accel X,Y,Z,magnet X,Y,Z\n
+# with any number of lines per datagram / TCP write. Lines that don't parse (e.g. a CSV header) are
+# counted & skipped, as are lines with nan/inf fields. Each TCP connection & each UDP source address is one device with its own filter
+# state. A TCP device ends when its connection closes, a UDP device after idle_timeout s without data.
+# Samples that aren't newer than the device's last one (e.g. reordered datagrams) are dropped, as are
+# samples the filter fails on (counted in filter_errors), without affecting the other devices.
+#
+# Publish (TCP): subscribers connected to the publish port receive one line per filtered sample,
+#   device,time,w,x,y,z\n
+# where device is 'tcp:<host>:<port>' or 'udp:<host>:<port>' of the sender. A subscriber that falls
+# behind (more than buffer_limit bytes unsent) misses lines rather than stalling the server. Sending
+# 'stats\n' on the publish port replies with the counters as one JSON line.
+#
+# Samples are not filtered as they arrive: received samples are queued, and the queue is processed in
+# one go once per event loop tick, after every socket that was ready has been read. This keeps the
+# per-sample overhead low under load and sends each subscriber one write per tick.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9750
+DEFAULT_PUBLISH_PORT = 9751
+N_FIELDS = len(CSV_COLUMNS)
+# Longest partial TCP line kept waiting for its newline, bytes
+MAX_LINE = 4096
+# Latencies kept for the percentiles in stats()
+LATENCY_WINDOW = 10000
+# Requested UDP receive buffer, bytes (the OS may cap it), holds bursts while a tick is processed
+UDP_RECEIVE_BUFFER = 1 << 22
+
+
+class _Device:
+    """
+    Filter state of one connected device
+    """
+    __slots__ = ('yaw_filter', 'last_time', 'last_seen', 'expires')
+
+    def __init__(self, yaw_filter, expires):
+        self.yaw_filter = yaw_filter
+        self.last_time = None
+        self.last_seen = perf_counter()
+        self.expires = expires
+
+
+class IngestServer:
+    """
+    Per-device filter state, the queue of received samples & the counters. The asyncio protocols below
+    feed it; see serve() to run it.
+    """
+
+    def __init__(self, alpha, alpha_2, accel_scale=None, mag_scale=None, idle_timeout=10.0,
+                 buffer_limit=1 << 20):
+        """
+        :param alpha: accelerometer gain
+        :param alpha_2: magnetometer gain
+        :param accel_scale: per-axis accelerometer magnitudes, None = normalize each reading
+        :param mag_scale: per-axis magnetometer magnitudes, None = normalize each reading
+        :param idle_timeout: seconds without data after which a UDP device is forgotten
+        :param buffer_limit: unsent bytes above which a subscriber misses lines
+        """
+        self.alpha = alpha
+        self.alpha_2 = alpha_2
+        self.accel_scale = accel_scale
+        self.mag_scale = mag_scale
+        self.idle_timeout = idle_timeout
+        self.buffer_limit = buffer_limit
+        self.devices = {}
+        self.subscribers = set()
+        self._pending = []
+        self._scheduled = False
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._started = perf_counter()
+        self.counters = {'connections': 0, 'packets': 0, 'samples_received': 0, 'samples_processed': 0,
+                         'bad_lines': 0, 'out_of_order': 0, 'ticks': 0, 'max_batch': 0, 'lines_published': 0,
+                         'lines_dropped': 0, 'filter_errors': 0}
+
+    def connect(self, device, expires=False):
+        """
+        Starts a new filter for device (replacing any previous state)
+        :param device: device name
+        :param expires: T = forget the device after idle_timeout s without data (UDP)
+        """
+        self.devices[device] = _Device(YawCorrector(self.alpha, self.alpha_2, self.accel_scale, self.mag_scale),
+                                       expires)
+        self.counters['connections'] += 1
+
+    def disconnect(self, device):
+        """
+        Forgets device, once the samples already queued for it are processed
+        """
+        asyncio.get_running_loop().call_soon(self.devices.pop, device, None)
+
+    def feed(self, device, data, expires=False):
+        """
+        Queues the samples in data for the next processing tick
+        :param device: device name
+        :param data: bytes, complete lines of the ten CSV fields
+        :param expires: passed to connect() if device is new
+        """
+        received = perf_counter()
+        if device not in self.devices:
+            self.connect(device, expires)
+        self.devices[device].last_seen = received
+        self.counters['packets'] += 1
+        n_queued = len(self._pending)
+        for line in data.split(b'\n'):
+            if not line.strip():
+                continue
+            try:
+                values = [float(v) for v in line.split(b',')]
+            except ValueError:
+                values = None
+            if values is None or len(values) != N_FIELDS or not all(map(math.isfinite, values)):
+                self.counters['bad_lines'] += 1
+                continue
+            self._pending.append((device, received, values))
+        self.counters['samples_received'] += len(self._pending) - n_queued
+        if self._pending and not self._scheduled:
+            asyncio.get_running_loop().call_soon(self.process)
+            self._scheduled = True
+
+    def process(self):
+        """
+        Filters every queued sample (in order of arrival) & publishes the orientations
+        """
+        self._scheduled = False
+        batch, self._pending = self._pending, []
+        lines = []
+        devices = self.devices
+        for device, received, (t, g_x, g_y, g_z, a_x, a_y, a_z, m_x, m_y, m_z) in batch:
+            state = devices.get(device)
+            if state is None:
+                continue
+            if state.last_time is not None and not t > state.last_time:
+                self.counters['out_of_order'] += 1
+                continue
+            f = state.yaw_filter
+            saved = f.w, f.x, f.y, f.z, f.last_time, f.q_ref, f.m_ref, f.theta_r
+            try:
+                w, x, y, z = f.update(t, (g_x, g_y, g_z), (a_x, a_y, a_z), (m_x, m_y, m_z))
+            except (ArithmeticError, ValueError):
+                # One device's bad sample shouldn't cost the rest of the tick, & is undone so the filter
+                # carries on as if it never arrived (update may fail after integrating the gyro)
+                f.w, f.x, f.y, f.z, f.last_time, f.q_ref, f.m_ref, f.theta_r = saved
+                self.counters['filter_errors'] += 1
+                continue
+            state.last_time = t
+            lines.append('%s,%.17g,%.17g,%.17g,%.17g,%.17g\n' % (device, t, w, x, y, z))
+
+        self.counters['ticks'] += 1
+        self.counters['max_batch'] = max(self.counters['max_batch'], len(batch))
+        self.counters['samples_processed'] += len(lines)
+        if lines:
+            payload = ''.join(lines).encode('ascii')
+            for transport in self.subscribers:
+                if transport.get_write_buffer_size() > self.buffer_limit:
+                    self.counters['lines_dropped'] += len(lines)
+                else:
+                    transport.write(payload)
+                    self.counters['lines_published'] += len(lines)
+        # Receive -> publish latency of each sample
+        done = perf_counter()
+        self._latencies.extend(done - received for _, received, _ in batch)
+
+    def expire_idle(self):
+        """
+        Forgets UDP devices that sent nothing for idle_timeout s
+        :return: number of devices removed
+        """
+        cutoff = perf_counter() - self.idle_timeout
+        idle = [device for device, state in self.devices.items() if state.expires and state.last_seen < cutoff]
+        for device in idle:
+            del self.devices[device]
+        return len(idle)
+
+    def stats(self):
+        """
+        :return: dict of the counters + devices, subscribers, uptime_s, samples_per_s (since start) &
+                 latency_ms (mean, p50, p99, max over the last LATENCY_WINDOW samples)
+        """
+        uptime = perf_counter() - self._started
+        latencies = sorted(self._latencies)
+        latency = {'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        if latencies:
+            latency = {'mean': 1e3 * sum(latencies) / len(latencies),
+                       'p50': 1e3 * latencies[len(latencies) // 2],
+                       'p99': 1e3 * latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+                       'max': 1e3 * latencies[-1]}
+        stats = dict(self.counters)
+        stats.update(devices=len(self.devices), subscribers=len(self.subscribers), uptime_s=uptime,
+                     samples_per_s=self.counters['samples_processed'] / uptime if uptime > 0 else 0.0,
+                     latency_ms=latency)
+        return stats
+
+
+# Device name of a socket address
+def device_name(protocol, address):
+    """
+    :param protocol: 'tcp' or 'udp'
+    :param address: (host, port, ...) socket address of the sender
+    :return: name orientations are published under
+    """
+    return '%s:%s:%d' % (protocol, address[0], address[1])
+
+
+class _TCPIngest(asyncio.Protocol):
+    """
+    One device per connection, lines may be split across reads
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.device = None
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.device = device_name('tcp', transport.get_extra_info('peername'))
+        self.server.connect(self.device)
+
+    def data_received(self, data):
+        lines, _, self.buffer = (self.buffer + data).rpartition(b'\n')
+        if lines:
+            self.server.feed(self.device, lines)
+        if len(self.buffer) > MAX_LINE:
+            self.server.counters['bad_lines'] += 1
+            self.buffer = b''
+
+    def connection_lost(self, exc):
+        self.server.disconnect(self.device)
+
+
+class _UDPIngest(asyncio.DatagramProtocol):
+    """
+    One device per source address, each datagram holds whole lines
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.feed(device_name('udp', addr), data, expires=True)
+
+
+class _Subscriber(asyncio.Protocol):
+    """
+    Receives the published orientations, can ask for the counters
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.subscribers.add(transport)
+
+    def data_received(self, data):
+        for command in data.split():
+            if command == b'stats':
+                self.transport.write(json.dumps(self.server.stats()).encode('ascii') + b'\n')
+
+    def connection_lost(self, exc):
+        self.server.subscribers.discard(self.transport)
+
+
+# Run the server
+async def serve(server, host=DEFAULT_HOST, port=DEFAULT_PORT, publish_port=DEFAULT_PUBLISH_PORT,
+                protocols=('udp', 'tcp'), stats_interval=5.0, ready=None):
+    """
+    Listens for IMU streams & subscribers until cancelled, printing the counters every stats_interval s
+    :param server: IngestServer
+    :param host: address to listen on
+    :param port: ingest port (UDP & TCP)
+    :param publish_port: TCP port subscribers connect to
+    :param protocols: which of 'udp', 'tcp' to accept samples over
+    :param stats_interval: seconds between counter printouts & idle device checks (0 = don't print)
+    :param ready: asyncio.Event set once listening
+    """
+    loop = asyncio.get_running_loop()
+    servers = [await loop.create_server(lambda: _Subscriber(server), host, publish_port)]
+    if 'tcp' in protocols:
+        servers.append(await loop.create_server(lambda: _TCPIngest(server), host, port))
+    udp = None
+    if 'udp' in protocols:
+        udp, _ = await loop.create_datagram_endpoint(lambda: _UDPIngest(server), local_addr=(host, port))
+        udp.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER)
+    if ready is not None:
+        ready.set()
+
+    try:
+        last_processed, last_time = 0, perf_counter()
+        while True:
+            await asyncio.sleep(stats_interval or 1.0)
+            server.expire_idle()
+            if stats_interval:
+                stats = server.stats()
+                now = perf_counter()
+                rate = (stats['samples_processed'] - last_processed) / (now - last_time)
+                last_processed, last_time = stats['samples_processed'], now
+                print("%d devices, %d subscribers | %.0f samples/s | latency mean %.2f ms, p99 %.2f ms | "
+                      "%d bad, %d out of order, %d filter errors, %d dropped" % (
+                          stats['devices'], stats['subscribers'], rate, stats['latency_ms']['mean'],
+                          stats['latency_ms']['p99'], stats['bad_lines'], stats['out_of_order'],
+                          stats['filter_errors'], stats['lines_dropped']), flush=True)
+    finally:
+        if udp is not None:
+            udp.close()
+        for s in servers:
+            s.close()
+            await s.wait_closed()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Filter live IMU streams (UDP/TCP) & publish the orientations")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="address to listen on (default: %s)" % DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="UDP & TCP ingest port (default: %d)" % DEFAULT_PORT)
+    parser.add_argument('--publish-port', type=int, default=DEFAULT_PUBLISH_PORT,
+                        help="TCP port subscribers connect to (default: %d)" % DEFAULT_PUBLISH_PORT)
+    parser.add_argument('--protocols', nargs='+', choices=('udp', 'tcp'), default=['udp', 'tcp'],
+                        help="accept samples over these (default: both)")
+    parser.add_argument('--alpha', type=float, default=0.05, help="accelerometer gain (default: 0.05)")
+    parser.add_argument('--alpha-2', type=float, default=0.00001, help="magnetometer gain (default: 0.00001)")
+    parser.add_argument('--scales-from', metavar='CSV',
+                        help="normalize accel/magnet by this recording's per-axis magnitudes, as the batch filters "
+                             "(default: normalize each reading)")
+    parser.add_argument('--idle-timeout', type=float, default=10.0,
+                        help="forget UDP devices silent for this many seconds (default: 10)")
+    parser.add_argument('--stats-interval', type=float, default=5.0,
+                        help="seconds between counter printouts, 0 = off (default: 5)")
+    args = parser.parse_args(argv)
+
+    accel_scale = mag_scale = None
+    if args.scales_from:
+        _, accel_scale, mag_scale = column_scales(args.scales_from)
+        accel_scale, mag_scale = tuple(accel_scale.tolist()), tuple(mag_scale.tolist())
+    server = IngestServer(args.alpha, args.alpha_2, accel_scale, mag_scale, args.idle_timeout)
+    print("Ingest on %s:%d (%s), publishing on tcp %s:%d" % (args.host, args.port, '/'.join(args.protocols),
+                                                            args.host, args.publish_port), flush=True)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.publish_port, args.protocols, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(server.stats()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import json
+import sys
+import time
+
+# --- Instrumentation ---
+# Stage timers for the pipeline (loading, gyro/tilt/yaw steps, euler conversion, plotting). Code marks
+# a stage with `with instrumentation.stage(name, samples):`. While profiling is disabled (the default)
+# stage() returns a shared do-nothing context manager & the per-sample loops skip their timers, so the
+# instrumentation can be left in place.
+#
+# Each stage records: calls, total seconds, samples processed (-> samples/s) & the net number of memory
+# blocks allocated (sys.getallocatedblocks). With track_allocations=True, tracemalloc is also used to
+# record the peak memory allocated inside each stage. Python < 3.9 can't reset the tracemalloc peak, a
+# stage's peak is then the highest since tracing started (an upper bound).
+
+
+class _NullStage:
+    """
+    Do-nothing context manager (contextlib.nullcontext needs Python 3.7)
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_profiler = None
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """
+    Collects stage statistics & passes each finished stage to registered hooks
+    """
+
+    def __init__(self, track_allocations=False):
+        """
+        :param track_allocations: also record peak allocated bytes per stage (tracemalloc, slower)
+        """
+        self.track_allocations = track_allocations
+        self.stats = {}
+        self.hooks = []
+        # Peak bytes seen so far by each open stage (outermost first), see _Stage
+        self._peaks = []
+
+    def add_hook(self, hook):
+        """
+        Registers hook(name, seconds, samples), called whenever a stage finishes
+        """
+        self.hooks.append(hook)
+
+    def record(self, name, seconds, samples=0, blocks=0, peak_bytes=None):
+        """
+        Adds one call of a stage to the statistics
+        :param name: stage name
+        :param seconds: time taken
+        :param samples: number of samples processed
+        :param blocks: net memory blocks allocated
+        :param peak_bytes: peak bytes allocated (tracemalloc)
+        """
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = {'calls': 0, 'seconds': 0.0, 'samples': 0, 'allocated_blocks': 0}
+        stat['calls'] += 1
+        stat['seconds'] += seconds
+        stat['samples'] += samples
+        stat['allocated_blocks'] += blocks
+        if peak_bytes is not None:
+            stat['peak_bytes'] = max(stat.get('peak_bytes', 0), peak_bytes)
+        for hook in self.hooks:
+            hook(name, seconds, samples)
+
+    def report(self):
+        """
+        :return: dict, stage name -> statistics incl. samples_per_second
+        """
+        report = {}
+        for name, stat in self.stats.items():
+            stat = dict(stat)
+            stat['samples_per_second'] = stat['samples'] / stat['seconds'] if stat['samples'] and stat['seconds'] else None
+            report[name] = stat
+        return report
+
+    def save_json(self, path):
+        """
+        Writes report() to a JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class _Stage:
+    """
+    Context manager timing one stage
+    """
+    __slots__ = ('profiler', 'name', 'samples', 'start', 'blocks')
+
+    def __init__(self, profiler, name, samples):
+        self.profiler = profiler
+        self.name = name
+        self.samples = samples
+
+    def __enter__(self):
+        if self.profiler.track_allocations:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # Keep the enclosing stage's peak so far, reset_peak would lose it
+            peaks = self.profiler._peaks
+            if peaks:
+                peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            peaks.append(0)
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        blocks = sys.getallocatedblocks() - self.blocks
+        peak_bytes = None
+        if self.profiler.track_allocations:
+            import tracemalloc
+            peaks = self.profiler._peaks
+            peak_bytes = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+            # The enclosing stage's peak includes this one's
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak_bytes)
+        self.profiler.record(self.name, seconds, self.samples, blocks, peak_bytes)
+        return False
+
+
+# Turn profiling on/off
+def enable(track_allocations=False):
+    """
+    Starts collecting stage statistics
+    :param track_allocations: also record peak allocated bytes per stage (tracemalloc, slower)
+    :return: the active Profiler
+    """
+    global _profiler
+    _profiler = Profiler(track_allocations)
+    return _profiler
+
+
+def disable():
+    """
+    Stops collecting stage statistics
+    :return: the Profiler that was active (or None)
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def enabled():
+    return _profiler is not None
+
+
+def profiler():
+    """
+    :return: the active Profiler, or None
+    """
+    return _profiler
+
+
+# Mark a stage
+def stage(name, samples=0):
+    """
+    Times the code in a with block as stage name (does nothing while profiling is disabled)
+    :param name: stage name
+    :param samples: number of samples the stage processes
+    :return: context manager
+    """
+    if _profiler is None:
+        return _NULL_STAGE
+    return _Stage(_profiler, name, samples)
+
+
+# Record a stage timed by the caller
+def record(name, seconds, samples=0):
+    """
+    Adds time measured by the caller (e.g. summed over a loop) to stage name, if profiling is enabled
+    """
+    if _profiler is not None:
+        _profiler.record(name, seconds, samples)
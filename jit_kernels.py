@@ -0,0 +1,245 @@
+import importlib.util
+import math
+import numpy as np
+from helperFunctions import quaternion_product, quaternion_to_conjugate
+
+# --- Compiled Filter Kernels (optional, Numba) ---
+# The tilt & yaw corrections feed each corrected orientation into the next step, so they can't be
+# vectorized. These kernels run the same per-sample loop as gyro_integration / drift_correction /
+# yaw_correction, compiled with numba.njit over preallocated arrays with the quaternion maths written
+# out on scalars. The operations (and their order) are exactly those of the helpers in
+# helperFunctions.py, so both backends give identical results.
+#
+# Numba is optional: without it NUMBA_AVAILABLE is False and backend='auto' uses the pure-Python loops.
+# Numba is only imported when a kernel is first run (importing it takes longer than the rest of
+# main.py's startup), the kernel functions below are plain Python until then. Compiled kernels are
+# cached on disk (numba cache=True), so only the first run pays for compiling.
+#
+# The kernels are also compiled for float32 (precision=np.float32): every constant is passed in as an
+# argument of the data's type (zero, one, two) so no step is promoted to float64, and the kernel then
+# runs on float32 state. renormalize_every=K rescales q to unit length every K samples, as float32
+# rounding errors otherwise build up in its norm.
+
+NUMBA_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+BACKENDS = ('auto', 'numba', 'python')
+
+# Filters a kernel runs
+GYRO_MODE = 0  # gyro_integration
+TILT_MODE = 1  # drift_correction
+YAW_MODE = 2  # yaw_correction
+
+
+# Pick a backend
+def use_jit(backend):
+    """
+    :param backend: 'auto' (numba if installed), 'numba' or 'python'
+    :return: T = run the compiled kernels, F = run the pure-Python loops
+    """
+    if backend == 'auto':
+        return NUMBA_AVAILABLE
+    if backend == 'numba':
+        if not NUMBA_AVAILABLE:
+            raise ImportError("backend='numba' needs numba installed (pip install numba)")
+        return True
+    if backend == 'python':
+        return False
+    raise ValueError("Unknown backend '%s', expected one of %s" % (backend, ", ".join(BACKENDS)))
+
+
+# Functions compiled by _compile (callees before callers)
+_KERNELS = ('_qmul', '_to_global', '_gyro_step', '_tilt_step', '_yaw_step', '_filter_kernel', '_multirate_kernel')
+_compiled = False
+
+
+# Compile the kernels
+def _compile():
+    """
+    Imports numba & replaces the kernel functions of this module with numba.njit versions (first call only).
+    The kernels call each other through the module globals, so they pick up the compiled versions.
+    """
+    global _compiled
+    if not _compiled:
+        from numba import njit
+        module = globals()
+        for name in _KERNELS:
+            module[name] = njit(cache=True)(module[name])
+        _compiled = True
+
+
+# Quaternion Product A * B (scalars)
+def _qmul(Wa, Xa, Ya, Za, Wb, Xb, Yb, Zb):
+    x = Xa * Wb + Ya * Zb - Za * Yb + Wa * Xb
+    y = -Xa * Zb + Ya * Wb + Za * Xb + Wa * Yb
+    z = Xa * Yb - Ya * Xb + Za * Wb + Wa * Zb
+    w = -Xa * Xb - Ya * Yb - Za * Zb + Wa * Wb
+    return w, x, y, z
+
+
+# Rotate xyz to the global frame: q * [0, xyz] * q^-1
+def _to_global(w, x, y, z, v_x, v_y, v_z, zero):
+    i_w, i_x, i_y, i_z = _qmul(zero, v_x, v_y, v_z, w, -x, -y, -z)
+    _, g_x, g_y, g_z = _qmul(w, x, y, z, i_w, i_x, i_y, i_z)
+    return g_x, g_y, g_z
+
+
+# Gyro Integration step
+def _gyro_step(q_w, q_x, q_y, q_z, g_x, g_y, g_z, dt, two):
+    l = math.sqrt(g_x ** two + g_y ** two + g_z ** two)
+    if l == 0:
+        # 0 reading = no rotation (theta = 0), as the Python loops
+        v_x, v_y, v_z = g_x, g_y, g_z
+    else:
+        v_x = g_x / l
+        v_y = g_y / l
+        v_z = g_z / l
+    theta = l * dt
+    s = math.sin(theta / two)
+    return _qmul(q_w, q_x, q_y, q_z, math.cos(theta / two), v_x * s, v_y * s, v_z * s)
+
+
+# Pitch & Roll Drift Correction step
+def _tilt_step(q_w, q_x, q_y, q_z, v_x, v_y, v_z, alpha, zero, one, two):
+    a_x, a_y, a_z = _to_global(q_w, q_x, q_y, q_z, v_x, v_y, v_z, zero)
+    # Angle between a^xyz & (0, 0, 1)
+    mag_u = math.sqrt(a_x ** two + a_y ** two + a_z ** two)
+    dot_prod = a_x * zero + a_y * zero + a_z * one
+    cos_phi = dot_prod / (mag_u * one)
+    if cos_phi > one or cos_phi < -one:
+        # As math.acos in Python (compiled acos returns NaN)
+        raise ValueError("math domain error")
+    phi = math.acos(cos_phi)
+    # Tilt axis (y, -x, 0), q(t, -alpha*phi)
+    theta = - alpha * phi
+    s = math.sin(theta / two)
+    return _qmul(q_w, q_x, q_y, q_z, math.cos(theta / two), a_y * s, -a_x * s, zero * s)
+
+
+# Yaw Drift Correction step
+def _yaw_step(q_w, q_x, q_y, q_z, v_x, v_y, v_z, theta_r, alpha_2, zero, one, two):
+    m_x, m_y, _ = _to_global(q_w, q_x, q_y, q_z, v_x, v_y, v_z, zero)
+    theta = math.atan2(m_y, -m_x)
+    theta = - alpha_2 * (theta - theta_r)
+    s = math.sin(theta / two)
+    return _qmul(q_w, q_x, q_y, q_z, math.cos(theta / two), zero * s, zero * s, one * s)
+
+
+# Filter loop
+def _filter_kernel(dt, gyro, accel, mag, alpha, alpha_2, theta_r, mode, zero, one, two, renormalize_every, q):
+    """
+    Runs the filter over every sample, writing orientations into q (N,4), q[0] = identity. dt[i] =
+    time[i] - time[i-1]; zero, one, two = 0, 1, 2 in the dtype of the data. renormalize_every = K
+    rescales q to unit length every K samples (0 = never).
+    """
+    q_w, q_x, q_y, q_z = one, zero, zero, zero
+    q[0, 0], q[0, 1], q[0, 2], q[0, 3] = q_w, q_x, q_y, q_z
+
+    # Start @ t=1 as @ t=0, orientation = [1,0,0,0]
+    for i in range(1, len(dt)):
+        q_w, q_x, q_y, q_z = _gyro_step(q_w, q_x, q_y, q_z, gyro[i, 0], gyro[i, 1], gyro[i, 2], dt[i], two)
+        if mode >= 1:
+            q_w, q_x, q_y, q_z = _tilt_step(q_w, q_x, q_y, q_z, accel[i, 0], accel[i, 1], accel[i, 2], alpha,
+                                            zero, one, two)
+        if mode >= 2:
+            q_w, q_x, q_y, q_z = _yaw_step(q_w, q_x, q_y, q_z, mag[i, 0], mag[i, 1], mag[i, 2], theta_r, alpha_2,
+                                           zero, one, two)
+        if renormalize_every > 0 and i % renormalize_every == 0:
+            norm = math.sqrt(q_w * q_w + q_x * q_x + q_y * q_y + q_z * q_z)
+            q_w, q_x, q_y, q_z = q_w / norm, q_x / norm, q_y / norm, q_z / norm
+        q[i, 0], q[i, 1], q[i, 2], q[i, 3] = q_w, q_x, q_y, q_z
+
+
+# Multi-rate filter loop (see multirate.py)
+def _multirate_kernel(dt, gyro, accel, mag, accel_gain, mag_gain, theta_r, zero, one, two, q):
+    """
+    As _filter_kernel (yaw mode), but each correction only runs on rows where its gain isn't NaN
+    """
+    q_w, q_x, q_y, q_z = one, zero, zero, zero
+    q[0, 0], q[0, 1], q[0, 2], q[0, 3] = q_w, q_x, q_y, q_z
+
+    for i in range(1, len(dt)):
+        q_w, q_x, q_y, q_z = _gyro_step(q_w, q_x, q_y, q_z, gyro[i, 0], gyro[i, 1], gyro[i, 2], dt[i], two)
+        if not math.isnan(accel_gain[i]):
+            q_w, q_x, q_y, q_z = _tilt_step(q_w, q_x, q_y, q_z, accel[i, 0], accel[i, 1], accel[i, 2],
+                                            accel_gain[i], zero, one, two)
+        if not math.isnan(mag_gain[i]):
+            q_w, q_x, q_y, q_z = _yaw_step(q_w, q_x, q_y, q_z, mag[i, 0], mag[i, 1], mag[i, 2], theta_r, mag_gain[i],
+                                           zero, one, two)
+        q[i, 0], q[i, 1], q[i, 2], q[i, 3] = q_w, q_x, q_y, q_z
+
+
+# Yaw reference angle
+def reference_angle(m_ref, q_ref=(1, 0, 0, 0)):
+    """
+    Angle of the reference magnetometer reading projected into the YX plane, theta_r of yaw_correction
+    (calculated with the same helpers, so it is identical)
+    :param m_ref: normalized magnetometer reading, xyz
+    :param q_ref: reference orientation, wxyz
+    :return: theta_r, rads
+    """
+    q_ref = list(q_ref)
+    m_ref_next = quaternion_product(q_ref, quaternion_product([0] + list(m_ref), quaternion_to_conjugate(q_ref)))[1:]
+    return math.atan2(m_ref_next[1], m_ref_next[0])
+
+
+# Sample intervals
+def _intervals(time, precision):
+    """
+    :param time: (N,) timestamps, float64
+    :param precision: dtype of the result
+    :return: (N,) dt[i] = time[i] - time[i-1] (dt[0] = 0), taken in float64 before rounding to precision
+    """
+    dt = np.zeros(len(time))
+    dt[1:] = np.diff(time)
+    return dt.astype(precision, copy=False)
+
+
+# Run a kernel on a recording
+def run_kernel(data, mode, alpha=0.0, alpha_2=0.0, dtype=np.float64, precision=np.float64, renormalize_every=0):
+    """
+    Compiled equivalent of gyro_integration (GYRO_MODE), drift_correction (TILT_MODE) or
+    yaw_correction (YAW_MODE)
+    :param data: IMURecording
+    :param mode: GYRO_MODE, TILT_MODE or YAW_MODE
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param dtype: dtype results are stored in
+    :param precision: dtype the filter computes in, np.float64 (same results as the Python loops) or
+                      np.float32
+    :param renormalize_every: rescale q to unit length every K samples (0 = never, as the Python loops)
+    :return: (N,4) orientations wxyz
+    """
+    precision = np.dtype(precision).type
+    if precision not in (np.float32, np.float64):
+        raise ValueError("precision must be float32 or float64, got %s" % np.dtype(precision))
+    gyro = data.gyro_rads.astype(precision, copy=False)
+    accel = data.accel_normalized.astype(precision, copy=False) if mode >= TILT_MODE else gyro
+    mag = data.mag_normalized.astype(precision, copy=False) if mode >= YAW_MODE else gyro
+    theta_r = reference_angle(data.mag_normalized[0].tolist()) if mode >= YAW_MODE else 0.0
+
+    q = np.empty((len(data), 4), dtype=precision)
+    if len(data):
+        _compile()
+        _filter_kernel(_intervals(data.time, precision), gyro, accel, mag, precision(alpha), precision(alpha_2),
+                       precision(theta_r), mode, precision(0), precision(1), precision(2), int(renormalize_every), q)
+    return q.astype(dtype, copy=False)
+
+
+# Run the multi-rate kernel on a recording
+def run_multirate_kernel(data, accel_gain, mag_gain, theta_r, dtype=np.float64):
+    """
+    Compiled equivalent of the loop in multirate.multirate_correction
+    :param data: IMURecording
+    :param accel_gain: (N,) accelerometer gain per row, NaN = no new reading
+    :param mag_gain: (N,) magnetometer gain per row, NaN = no new reading
+    :param theta_r: reference angle, see reference_angle
+    :param dtype: dtype results are stored in
+    :return: (N,4) orientations wxyz
+    """
+    q = np.empty((len(data), 4))
+    if len(data):
+        _compile()
+        _multirate_kernel(_intervals(data.time, np.float64), data.gyro_rads, data.accel_normalized, data.mag_normalized,
+                          np.ascontiguousarray(accel_gain, dtype=float), np.ascontiguousarray(mag_gain, dtype=float),
+                          float(theta_r), 0.0, 1.0, 2.0, q)
+    return q.astype(dtype, copy=False)
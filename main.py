@@ -1,22 +1,37 @@
-import pandas as pd
-from gyro_integration import gyro_integration
-from drift_correction import drift_correction
-from yaw_correction import yaw_correction
-from plotter import *
+import argparse
+import sys
+import numpy as np
+import instrumentation
+from imu_data import load_recording
+from orientation_engine import run_filters, STREAMS
+from result_cache import ResultCache, cached_run_filters, DEFAULT_CACHE_DIR
+from jit_kernels import BACKENDS
 
 # --- READ ME ---
 
 """
 - Python v3.6.5 used.
 
-- Run the file from a command line and it will display all of the relevant
-  graphs/figures one after another.
+- Run the file from a command line and by default it will display all of the relevant
+  graphs/figures one after another:  python main.py [IMUData.csv]
+
+- Everything is set with command line options (python main.py --help), e.g.
+    python main.py --alpha 0.05 --alpha-2 0.00001       alpha values (defaults give best results)
+    python main.py --plots 3d tilt                      only these plots (3d, 2d, data, gyro, tilt, yaw)
+    python main.py --half-time                          3d plot at half speed
+    python main.py --video                              output a video of the 3d plot
+    python main.py --filters yaw -o q.npz --plots       compute only & save results (npz or csv)
+    python main.py --clear-cache                        recompute results (see python result_cache.py)
+    python main.py --profile profile.json               time each stage (see instrumentation.py)
+  A compute-only run never imports matplotlib, and pandas is only needed the first time a CSV is
+  read (after that the binary cache next to it is used).
+
+- Long recordings can be converted to a memory mapped binary trace (python imu_trace.py IMUData.csv)
+  and the .imut file passed instead of the CSV.
+
+- To process many recordings at once use batch.py, e.g.
+    python batch.py sessions/ -o results/ -j 8     (see python batch.py --help)
 
-- The graphs that are produce you can control by scrolling to the bottom: I have
-  included a few bools for you to make things easy. The default setting which I 
-  have left will display all required graphs, starting with the 3d animated plot,
-  followed by the other 2 tri-axial plots.
-  
 - The helper functions are all the functions from part 1 + a few extras (see helpderFunctions.py).
 
 - Part 2,3 & 4 are all within their own files: part 2 -> gyro_integration, part 3 -> drift_correction,
@@ -25,67 +40,127 @@ from plotter import *
 - Each file contains the prev. implemenation + the changes from the next section i.e. yaw correction = 
   drift correction + extra stuff: yaw > drift > gyro
 
-- If you wish to change alpha values, these are located on lines 46-47
-  
-
-- Specifically regarding the 3d plot, use the halfTime param (again scroll down) to set
-  whether half speed or not.
-
-- Use the video param to output a video (requires FFMPEG installed)
+- main.py produces all 3 sets of results in a single pass using orientation_engine.py, which gives
+  the same results as running the 3 files above one after another.
+  Results are cached on disk (.orientation_cache) so reruns with the same data & alphas start instantly.
 
 """
 
-# --- Set Alpha values & Load data for producing graphs ---
-
-# Set values of alpha (defaults give best results, alpha=0.05, alpha_2=0.00001)
-alpha = 0.05  # Accelerometer
-alpha_2 = 0.00001  # Magnetometer
-
-# Generate 3 sets of data
-q1 = gyro_integration()
-q2 = drift_correction(alpha)
-q3 = yaw_correction(alpha, alpha_2)
-
-# Data Needed for Graphs
-data = pd.read_csv("IMUData.csv")
-time = data['time'].tolist()
-gyro_X = data['gyroscope.X'].tolist()
-gyro_Y = data['gyroscope.Y'].tolist()
-gyro_Z = data['gyroscope.Z'].tolist()
-accel_X = data['accelerometer.X'].tolist()
-accel_Y = data['accelerometer.Y'].tolist()
-accel_Z = data['accelerometer.Z'].tolist()
-magnet_X = data['magnetometer.X'].tolist()
-magnet_Y = data['magnetometer.Y'].tolist()
-magnet_Z = data['magnetometer.Z'].tolist()
-gyro_X, gyro_Y, gyro_Z = convert_deg_to_rads(gyro_X, gyro_Y, gyro_Z)
-
-
-# --- Produce Plots ---
-
-# Choose here what plots you want to produce
-orientation_3d = True  # Orientation Tri-axial 3d
-orientation_2d = True  # Orientation Tri-axial 2d
-triax_plot = True  # CSV Data
-plot_gyro = True  # Gyro
-plot_tilt = True  # Gyro + Drift Correction
-plot_yaw = True  # Gyro + Drift + Yaw Correction
-
-halfTime = False  # Param for orientation_3d
-video = False  # Param for orientation_3d
+PLOTS = ('3d', '2d', 'data', 'gyro', 'tilt', 'yaw')
+
+
+# Command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Head orientation from IMU data (gyro, + drift, + yaw correction)")
+    parser.add_argument('input', nargs='?', default='IMUData.csv', help="IMU CSV file or .imut trace (default: IMUData.csv)")
+    parser.add_argument('--alpha', type=float, default=0.05, help="accelerometer gain (default: 0.05)")
+    parser.add_argument('--alpha-2', type=float, default=0.00001, help="magnetometer gain (default: 0.00001)")
+    parser.add_argument('--filters', nargs='+', choices=STREAMS, default=list(STREAMS),
+                        help="results to compute (default: all)")
+    parser.add_argument('--backend', choices=BACKENDS, default='auto',
+                        help="filter loops: compiled with numba, pure Python, or numba if installed (default: auto)")
+    parser.add_argument('--float32', action='store_true',
+                        help="compute & store orientations in float32 (see precision.py for the error)")
+    parser.add_argument('--renormalize-every', type=int, default=0, metavar='K',
+                        help="rescale orientations to unit length every K samples (default: 0 = never)")
+    parser.add_argument('-o', '--output', help="save results to this file")
+    parser.add_argument('--format', choices=('npz', 'csv'), default=None,
+                        help="output format (default: from the output file extension, else npz)")
+    parser.add_argument('--plots', nargs='*', choices=PLOTS, default=None,
+                        help="plots to show (default: all, or none when --output is given; "
+                             "--plots with no names = no plots)")
+    parser.add_argument('--half-time', action='store_true', help="3d plot at half speed")
+    parser.add_argument('--video', action='store_true', help="output the 3d plot as a video instead")
+    parser.add_argument('--no-cache', action='store_true', help="don't read/write the binary data cache")
+    parser.add_argument('--no-result-cache', action='store_true', help="always recompute the filter results")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="filter result cache directory (default: %s)" % DEFAULT_CACHE_DIR)
+    parser.add_argument('--clear-cache', action='store_true', help="empty the filter result cache first")
+    parser.add_argument('--profile', metavar='REPORT_JSON',
+                        help="time each stage (load, filter steps, euler, plots) & write a JSON report")
+    parser.add_argument('--profile-allocations', action='store_true',
+                        help="with --profile, also record peak memory per stage (slower)")
+    args = parser.parse_args(argv)
+    if args.plots is None:
+        args.plots = [] if args.output else list(PLOTS)
+    if args.format is None:
+        args.format = 'csv' if args.output and args.output.lower().endswith('.csv') else 'npz'
+    return args
+
 
 # --- Produce Graphs ---
-if orientation_3d:
-    orientation_plot_3d(q1, q2, q3, halfTime, video, time)
-if orientation_2d:
-    triaxial_orientation(q1, q2, q3, alpha, alpha_2, time)
-if triax_plot:
-    triaxial_plot(gyro_X, gyro_Y, gyro_Z, accel_X, accel_Y, accel_Z, magnet_X, magnet_Y, magnet_Z, time)
-if plot_gyro:
-    orientation_plot_2d(q1, 0, alpha, alpha_2, time)
-if plot_tilt:
-    orientation_plot_2d(q2, 1, alpha, alpha_2, time)
-if plot_yaw:
-    orientation_plot_2d(q3, 2, alpha, alpha_2, time)
-
-print("Finished.")
+def show_plots(args, data, results):
+    """
+    Displays the chosen plots (matplotlib is only imported here)
+    """
+    from orientation_result import precompute_euler
+    import plotter
+
+    # 3D & tri-axial orientation plots compare all 3 filters
+    needed = {'3d': STREAMS, '2d': STREAMS, 'gyro': ('gyro',), 'tilt': ('tilt',), 'yaw': ('yaw',)}
+    missing = [plot for plot in args.plots if any(stream not in results for stream in needed.get(plot, ()))]
+    if missing:
+        raise SystemExit("Plots %s need filters that weren't run (see --filters)" % ", ".join(missing))
+
+    if set(args.plots) & {'2d', 'gyro', 'tilt', 'yaw'}:
+        # Euler angles for all 2D plots, converted once (quaternions are left as they are for the 3D plot)
+        precompute_euler(*results.values())
+
+    alpha, alpha_2, time = args.alpha, args.alpha_2, data.time
+    for plot in args.plots:
+        if plot == '3d':
+            plotter.orientation_plot_3d(results['gyro'], results['tilt'], results['yaw'], args.half_time, args.video, time)
+        elif plot == '2d':
+            plotter.triaxial_orientation(results['gyro'], results['tilt'], results['yaw'], alpha, alpha_2, time)
+        elif plot == 'data':
+            # Data needed for graphs (views of the loaded arrays)
+            gyro_X, gyro_Y, gyro_Z = data.gyro_rads.T
+            accel_X, accel_Y, accel_Z = data.accel.T
+            magnet_X, magnet_Y, magnet_Z = data.mag.T
+            plotter.triaxial_plot(gyro_X, gyro_Y, gyro_Z, accel_X, accel_Y, accel_Z, magnet_X, magnet_Y, magnet_Z, time)
+        else:
+            plotter.orientation_plot_2d(results[plot], STREAMS.index(plot), alpha, alpha_2, time)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.profile:
+        instrumentation.enable(args.profile_allocations)
+
+    # Load data once (binary cache is used on repeat runs)
+    with instrumentation.stage('main.load'):
+        data = load_recording(args.input, use_cache=not args.no_cache)
+
+    # Generate results (single pass, see orientation_engine.py), reusing results of previous runs
+    # with the same data & alphas (see result_cache.py)
+    precision = np.float32 if args.float32 else np.float64
+    with instrumentation.stage('main.filters', len(data)):
+        if args.no_result_cache:
+            results = run_filters(data, args.alpha, args.alpha_2, args.filters, backend=args.backend,
+                                  precision=precision, renormalize_every=args.renormalize_every)
+        else:
+            cache = ResultCache(args.cache_dir)
+            if args.clear_cache:
+                cache.invalidate()
+            results = cached_run_filters(args.input, data, args.alpha, args.alpha_2, args.filters, cache,
+                                         args.backend, precision, args.renormalize_every)
+
+    if args.output:
+        from orientation_result import save_results
+        with instrumentation.stage('main.save', len(data)):
+            save_results(args.output, results, args.format)
+        print("Saved %s" % args.output)
+
+    if args.plots:
+        show_plots(args, data, results)
+
+    if args.profile:
+        instrumentation.disable().save_json(args.profile)
+        print("Profile written to %s" % args.profile)
+
+    print("Finished.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
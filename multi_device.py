@@ -0,0 +1,154 @@
+import numpy as np
+from helperFunctions import *
+
+# --- Multi-Device Tracking ---
+# Runs the yaw corrected filter (see streaming_filters.YawCorrector) for many devices at once. The
+# state of every device is held in (N_devices, ...) arrays and each tick advances all devices with a
+# handful of vectorized operations, instead of one Python loop iteration per device.
+#
+# The state & arithmetic can be float32 (dtype=np.float32): half the memory & bandwidth of float64,
+# and twice the values per SIMD instruction in NumPy's loops. Rounding errors then build up in the
+# norm of q (no filter step renormalizes it), so renormalize_every=K rescales each device's q to unit
+# length every K of its samples (counted per device, so devices that skip ticks are renormalized too).
+
+
+class MultiDeviceTracker:
+    """
+    Gyro integration + pitch & roll drift correction + yaw drift correction for N devices
+    """
+
+    def __init__(self, n_devices, alpha, alpha_2, accel_scale=None, mag_scale=None, dtype=np.float64,
+                 renormalize_every=0):
+        """
+        :param n_devices: number of devices
+        :param alpha: accelerometer gain, scalar or (N,) per device
+        :param alpha_2: magnetometer gain, scalar or (N,) per device
+        :param accel_scale: (N,3) or (3,) per-axis accelerometer magnitudes, None = normalize each reading
+        :param mag_scale: (N,3) or (3,) per-axis magnetometer magnitudes, None = normalize each reading
+        :param dtype: dtype of the state & arithmetic, np.float64 or np.float32
+        :param renormalize_every: rescale each orientation to unit length every K samples of its device
+                                  (0 = never)
+        """
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError("dtype must be float32 or float64, got %s" % np.dtype(dtype))
+        self.n_devices = n_devices
+        self.dtype = np.dtype(dtype)
+        self.renormalize_every = int(renormalize_every)
+        # Samples integrated per device (as the sample index i of the single device kernels)
+        self.steps = np.zeros(n_devices, dtype=np.int64)
+        self.alpha = np.broadcast_to(np.asarray(alpha, dtype=dtype), (n_devices,)).copy()
+        self.alpha_2 = np.broadcast_to(np.asarray(alpha_2, dtype=dtype), (n_devices,)).copy()
+        self.accel_scale = None if accel_scale is None else np.broadcast_to(np.asarray(accel_scale, dtype=dtype), (n_devices, 3))
+        self.mag_scale = None if mag_scale is None else np.broadcast_to(np.asarray(mag_scale, dtype=dtype), (n_devices, 3))
+        self._z_axis = np.array([0, 0, 1], dtype=dtype)
+
+        # init orientation = identity quaternion : [w, x, y, z]
+        self.q = np.zeros((n_devices, 4), dtype=dtype)
+        self.q[:, 0] = 1
+        # Timestamps stay float64, float32 can't resolve sample intervals once t is large
+        self.last_time = np.full(n_devices, np.nan)
+        # Reference frame, set from each device's first sample
+        self.q_ref = self.q.copy()
+        self.m_ref = np.zeros((n_devices, 3), dtype=dtype)
+        self.theta_r = np.zeros(n_devices, dtype=dtype)
+        # Errors measured on each device's last sample: tilt angle phi & yaw error theta - theta_r
+        self.tilt_error = np.zeros(n_devices, dtype=dtype)
+        self.yaw_error = np.zeros(n_devices, dtype=dtype)
+
+    @staticmethod
+    def _normalize(v, scale):
+        """
+        Normalizes readings v (N,3), either to unit vectors (scale=None) or by per-axis magnitudes
+        """
+        if scale is None:
+            mag = np.sqrt(np.sum(v ** 2, axis=1, keepdims=True))
+        else:
+            mag = np.asarray(scale, dtype=v.dtype)
+        return np.divide(v, mag, out=np.zeros_like(v), where=mag != 0)
+
+    def _set_reference(self, idx, q_ref, m_ref):
+        """
+        Sets the reference orientation & normalized magnetometer reading for devices idx
+        """
+        self.q_ref[idx] = q_ref
+        self.m_ref[idx] = m_ref
+        # m_ref' projected into YX plane, constant for a given reference
+        m_ref_next = point_rotation_by_quaternion_batch(m_ref, q_ref)
+        self.theta_r[idx] = np.arctan2(m_ref_next[:, 1], m_ref_next[:, 0])
+
+    def step(self, t, gyro, accel, mag, mask=None):
+        """
+        Advances every device by one sample. Devices without a sample this tick (mask False, or any NaN
+        in their row) keep their state; their next sample integrates over the whole gap.
+        :param t: (N,) timestamps, s
+        :param gyro: (N,3) gyroscope XYZ, deg/s
+        :param accel: (N,3) accelerometer XYZ
+        :param mag: (N,3) magnetometer XYZ
+        :param mask: (N,) bool, devices with a new sample (default: all)
+        :return: (N,4) orientations, wxyz
+        """
+        t = np.broadcast_to(np.asarray(t, dtype=float), (self.n_devices,))
+        gyro = np.asarray(gyro, dtype=self.dtype)
+        accel = np.asarray(accel, dtype=self.dtype)
+        mag = np.asarray(mag, dtype=self.dtype)
+
+        valid = ~(np.isnan(t) | np.isnan(gyro).any(axis=1) | np.isnan(accel).any(axis=1) | np.isnan(mag).any(axis=1))
+        if mask is not None:
+            valid &= np.asarray(mask, dtype=bool)
+
+        # First sample for a device: @ t=0, orientation = [1,0,0,0], set reference frame
+        first = valid & np.isnan(self.last_time)
+        if first.any():
+            idx = np.flatnonzero(first)
+            m = self._normalize(mag[idx], None if self.mag_scale is None else self.mag_scale[idx])
+            self._set_reference(idx, self.q[idx], m)
+            self.last_time[idx] = t[idx]
+
+        idx = np.flatnonzero(valid & ~first)
+        if len(idx) == 0:
+            return self.q
+        q = self.q[idx]
+        alpha = self.alpha[idx]
+        alpha_2 = self.alpha_2[idx]
+        accel = self._normalize(accel[idx], None if self.accel_scale is None else self.accel_scale[idx])
+        mag = self._normalize(mag[idx], None if self.mag_scale is None else self.mag_scale[idx])
+
+        # --- Gyro Integration (Gyroscope) ---
+        g = np.radians(gyro[idx])
+        l = np.sqrt(g[:, 0] ** 2 + g[:, 1] ** 2 + g[:, 2] ** 2)
+        v = np.divide(g, l[:, None], out=np.zeros_like(g), where=l[:, None] != 0)
+        theta = l * (t[idx] - self.last_time[idx]).astype(self.dtype)
+        q = quaternion_product_batch(q, v_theta_to_quaternion_batch(v, theta))
+
+        # --- Pitch & Roll Drift Correction (Accelerometer) ---
+        a_hat = point_rotation_by_quaternion_batch(accel, q)
+        # 0/0 once a diverging device's q has shrunk to 0: phi & from then on q are NaN (see is_finite)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            phi = angle_between_vectors_batch(a_hat, self._z_axis)
+        # Tilt axis (y, -x, 0)
+        tilt_axis = np.stack([a_hat[:, 1], -a_hat[:, 0], np.zeros(len(idx), dtype=self.dtype)], axis=1)
+        q = quaternion_product_batch(q, v_theta_to_quaternion_batch(tilt_axis, - alpha * phi))
+
+        # --- Yaw Drift Correction (Magnetometer) ---
+        m_next = point_rotation_by_quaternion_batch(mag, q)
+        theta = np.arctan2(m_next[:, 1], -m_next[:, 0])
+        q = quaternion_product_batch(q, v_theta_to_quaternion_batch(self._z_axis, - alpha_2 * (theta - self.theta_r[idx])))
+
+        steps = self.steps[idx] + 1
+        self.steps[idx] = steps
+        if self.renormalize_every:
+            due = steps % self.renormalize_every == 0
+            if due.any():
+                q[due] /= np.sqrt(np.sum(q[due] ** 2, axis=1, keepdims=True))
+
+        self.q[idx] = q
+        self.tilt_error[idx] = phi
+        self.yaw_error[idx] = theta - self.theta_r[idx]
+        self.last_time[idx] = t[idx]
+        return self.q
+
+    def is_finite(self):
+        """
+        :return: (N,) bool, F for devices whose orientation has become NaN/inf (the filter diverged)
+        """
+        return np.isfinite(self.q).all(axis=1)
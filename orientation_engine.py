@@ -0,0 +1,213 @@
+from time import perf_counter
+from helperFunctions import *
+import instrumentation
+import jit_kernels
+from multi_device import MultiDeviceTracker
+from orientation_result import OrientationResult
+
+# --- Fused Orientation Engine ---
+# gyro_integration, drift_correction & yaw_correction each walk the whole recording, recomputing the
+# same gyro quaternions every time. The engine walks the samples once, computes each gyro delta
+# quaternion once and advances whichever of the three output streams were asked for.
+#
+# Precision mode: precision=np.float32 computes & stores the orientations in float32 (half the memory
+# of float64 for stored streams), renormalize_every=K rescales q to unit length every K samples. None of
+# the filters renormalize q on their own, so its norm drifts over long recordings (by ~5% over
+# IMUData.csv in float64), and faster in float32. Note the corrections aren't scale invariant, so
+# renormalized results differ from the unrenormalized reference by more than float32 rounding does.
+# See precision.py for an error report against the float64 filters.
+
+GYRO = 'gyro'  # Gyro only (gyro_integration)
+TILT = 'tilt'  # Gyro + Drift Correction (drift_correction)
+YAW = 'yaw'  # Gyro + Drift & Yaw Correction (yaw_correction)
+STREAMS = (GYRO, TILT, YAW)
+
+
+# Gyro delta quaternions for every sample
+def gyro_delta_quaternions(data):
+    """
+    Calculates the quaternion rotation over each time step from the gyro readings (vectorized)
+    :param data: IMURecording
+    :return: (N,4) array, row i = rotation between sample i-1 and i (row 0 = identity)
+    """
+    gyro = data.gyro_rads
+    # Calc l, magnitude of gyro readings & v, normalized gyro readings (0 reading = no rotation)
+    l = np.sqrt(gyro[:, 0] ** 2 + gyro[:, 1] ** 2 + gyro[:, 2] ** 2)
+    v = np.divide(gyro, l[:, None], out=np.zeros_like(gyro), where=l[:, None] != 0)
+    # Calc theta
+    theta = np.empty_like(l)
+    theta[0] = 0
+    theta[1:] = l[1:] * np.diff(data.time)
+    dq = v_theta_to_quaternion_batch(v, theta)
+    dq[0] = [1, 0, 0, 0]
+    return dq
+
+
+# Pitch & Roll Drift Correction (Accelerometer)
+def tilt_correction(q_new, a, alpha):
+    """
+    Corrects pitch & roll drift of q_new using accelerometer reading a
+    :param q_new: orientation after gyro integration, wxyz
+    :param a: normalized accelerometer reading, xyz
+    :param alpha: accelerometer gain
+    :return: corrected orientation, wxyz
+    """
+    # Transform accelerometer to global frame
+    # a^ = q^{-1} * a- * q  (multiply in reverse order)
+    q_inverse = quaternion_to_conjugate(q_new)
+    a_hat = quaternion_product(q_new, quaternion_product([0, a[0], a[1], a[2]], q_inverse))[1:]
+    # Calc angle between a^xyz & (0, 0, 1) - Z axis is up
+    phi = angle_between_vectors(a_hat, [0, 0, 1])
+    # Tilt axis (y, -x, 0), obtain q(t, -alpha*phi)
+    w, x, y, z = v_theta_to_quaternion([a_hat[1], -a_hat[0], 0], - alpha * phi)
+    # Correct for drift
+    return quaternion_product(q_new, [w, x, y, z])
+
+
+# Yaw Drift Correction (Magnetometer)
+def yaw_drift_correction(q_new, m, theta_r, alpha_2):
+    """
+    Corrects yaw drift of q_new using magnetometer reading m
+    :param q_new: orientation after tilt correction, wxyz
+    :param m: normalized magnetometer reading, xyz
+    :param theta_r: reference angle, from jit_kernels.reference_angle(m_ref, q_ref)
+    :param alpha_2: magnetometer gain
+    :return: corrected orientation, wxyz
+    """
+    # Calculate q^-1 & m'
+    q_inverse = quaternion_to_conjugate(q_new)
+    m_next = quaternion_product(q_new, quaternion_product([0, m[0], m[1], m[2]], q_inverse))[1:]
+    # Project m' into YX plane (m_ref' is fixed, so theta_r is calculated once)
+    theta = math.atan2(m_next[1], -m_next[0])
+    # Correct for drift using complementary filter
+    w, x, y, z = v_theta_to_quaternion([0, 0, 1], - alpha_2 * (theta - theta_r))
+    return quaternion_product(q_new, [w, x, y, z])
+
+
+# Rescale a quaternion to unit length
+def _unit(q):
+    """
+    :param q: quaternion, wxyz
+    :return: q / |q| (same operations as the compiled kernels' renormalization)
+    """
+    w, x, y, z = q
+    norm = math.sqrt(w * w + x * x + y * y + z * z)
+    return [w / norm, x / norm, y / norm, z / norm]
+
+
+# Run the filters as devices of a MultiDeviceTracker
+def _run_tracked(data, alpha, alpha_2, streams, precision, renormalize_every):
+    """
+    Vectorized over the streams: each stream is one device, gyro only = both gains 0 & drift corrected
+    = magnetometer gain 0 (a correction by angle 0 leaves q unchanged)
+    :return: dict, stream name -> (N,4) orientations in precision
+    """
+    gains = {GYRO: (0.0, 0.0), TILT: (alpha, 0.0), YAW: (alpha, alpha_2)}
+    n = len(streams)
+    tracker = MultiDeviceTracker(n, [gains[s][0] for s in streams], [gains[s][1] for s in streams],
+                                 np.ones(3), np.ones(3), precision, renormalize_every)
+    q = np.empty((len(data), n, 4), dtype=precision)
+    gyro, accel, mag = data.gyro, data.accel_normalized, data.mag_normalized
+    for i in range(len(data)):
+        q[i] = tracker.step(data.time[i], np.broadcast_to(gyro[i], (n, 3)), np.broadcast_to(accel[i], (n, 3)),
+                            np.broadcast_to(mag[i], (n, 3)))
+        if not tracker.is_finite().all():
+            # The Python & numba loops fail here with a math domain error
+            raise ValueError("Orientation became non-finite at sample %d (the filter diverged)" % i)
+    return {stream: np.ascontiguousarray(q[:, k]) for k, stream in enumerate(streams)}
+
+
+# Run the three filters in a single pass
+def run_filters(data, alpha, alpha_2, streams=STREAMS, dtype=None, backend='auto', precision=np.float64,
+                renormalize_every=0):
+    """
+    Produces the gyro only, drift corrected & yaw corrected orientations in one pass over the data.
+    Results match gyro_integration, drift_correction & yaw_correction (float64, no renormalization).
+    :param data: IMURecording
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param streams: which of GYRO, TILT, YAW to produce
+    :param dtype: dtype results are stored in (float64 or float32, default: precision)
+    :param backend: 'auto' (compiled kernels if numba is installed), 'numba' or 'python'
+    :param precision: dtype the filters compute in, np.float64 or np.float32
+    :param renormalize_every: rescale q to unit length every K samples (0 = never)
+    :return: dict, stream name -> OrientationResult
+    """
+    for stream in streams:
+        if stream not in STREAMS:
+            raise ValueError("Unknown stream '%s', expected one of %s" % (stream, ", ".join(STREAMS)))
+    precision = np.dtype(precision).type
+    if precision not in (np.float32, np.float64):
+        raise ValueError("precision must be float32 or float64, got %s" % np.dtype(precision))
+    dtype = precision if dtype is None else dtype
+    if jit_kernels.use_jit(backend):
+        # Compiled kernels: one fast pass per stream beats sharing the gyro step in Python
+        modes = {GYRO: jit_kernels.GYRO_MODE, TILT: jit_kernels.TILT_MODE, YAW: jit_kernels.YAW_MODE}
+        results = {}
+        for stream in streams:
+            with instrumentation.stage('engine.%s_kernel' % stream, len(data)):
+                q = jit_kernels.run_kernel(data, modes[stream], alpha, alpha_2, dtype, precision, renormalize_every)
+            results[stream] = OrientationResult(q, data.time)
+        return results
+    if precision is not np.float64:
+        # Python floats are float64, compute in float32 with the vectorized tracker (much slower than numba)
+        with instrumentation.stage('engine.tracked', len(data)):
+            tracked = _run_tracked(data, alpha, alpha_2, streams, precision, renormalize_every)
+        return {stream: OrientationResult(q.astype(dtype, copy=False), data.time) for stream, q in tracked.items()}
+    do_gyro, do_tilt, do_yaw = GYRO in streams, TILT in streams, YAW in streams
+
+    with instrumentation.stage('engine.gyro_delta', len(data)):
+        dq = gyro_delta_quaternions(data).tolist()
+    accel = data.accel_normalized.tolist() if (do_tilt or do_yaw) else None
+    magnet = data.mag_normalized.tolist() if do_yaw else None
+
+    # init orientation = identity quaternion : [w, x, y, z]
+    results = {stream: np.empty((len(dq), 4), dtype=dtype) for stream in streams}
+    for q in results.values():
+        q[0] = [1, 0, 0, 0]
+    q1 = q2 = q3 = [1, 0, 0, 0]
+
+    # Get initial m_ref and q_ref vals, m_ref' projected into YX plane never changes
+    theta_r = jit_kernels.reference_angle(magnet[0], [1, 0, 0, 0]) if do_yaw else None
+
+    # Per-stream timers, only run while profiling (see instrumentation.py)
+    timed = instrumentation.enabled()
+    gyro_time = tilt_time = yaw_time = 0.0
+
+    # Start @ t=1 as @ t=0, orientation = [1,0,0,0]
+    for i in range(1, len(dq)):
+        renormalize = renormalize_every and i % renormalize_every == 0
+        if timed:
+            tic = perf_counter()
+        if do_gyro:
+            q1 = quaternion_product(q1, dq[i])
+            if renormalize:
+                q1 = _unit(q1)
+            results[GYRO][i] = q1
+        if timed:
+            toc = perf_counter()
+            gyro_time += toc - tic
+            tic = toc
+        if do_tilt:
+            q2 = tilt_correction(quaternion_product(q2, dq[i]), accel[i], alpha)
+            if renormalize:
+                q2 = _unit(q2)
+            results[TILT][i] = q2
+        if timed:
+            toc = perf_counter()
+            tilt_time += toc - tic
+            tic = toc
+        if do_yaw:
+            q_new = tilt_correction(quaternion_product(q3, dq[i]), accel[i], alpha)
+            q3 = yaw_drift_correction(q_new, magnet[i], theta_r, alpha_2)
+            if renormalize:
+                q3 = _unit(q3)
+            results[YAW][i] = q3
+        if timed:
+            yaw_time += perf_counter() - tic
+
+    for stream, seconds in ((GYRO, gyro_time), (TILT, tilt_time), (YAW, yaw_time)):
+        if stream in streams:
+            instrumentation.record('engine.%s_stream' % stream, seconds, len(dq) - 1)
+
+    return {stream: OrientationResult(results[stream], data.time) for stream in streams}
@@ -0,0 +1,138 @@
+import numpy as np
+from helperFunctions import quaternion_to_euler_batch
+import instrumentation
+
+# --- Orientation Results ---
+
+
+class OrientationResult:
+    """
+    Orientations produced by a filter: an (N,4) array of quaternions wxyz (one row per sample) plus
+    the timestamps they belong to. Rows/columns are returned as views of the array, euler angles are
+    only computed when first asked for.
+    """
+
+    def __init__(self, q, time=None):
+        """
+        :param q: (N,4) array of quaternions wxyz
+        :param time: (N,) timestamps, s
+        """
+        self.q = np.asarray(q)
+        self.time = None if time is None else np.asarray(time)
+        self._euler = None
+        self._euler_degrees = None
+
+    def __len__(self):
+        return len(self.q)
+
+    def __getitem__(self, i):
+        return self.q[i]
+
+    def __iter__(self):
+        return iter(self.q)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or dtype == self.q.dtype:
+            return self.q.copy() if copy else self.q
+        return self.q.astype(dtype)
+
+    @property
+    def dtype(self):
+        return self.q.dtype
+
+    @property
+    def w(self):
+        return self.q[:, 0]
+
+    @property
+    def x(self):
+        return self.q[:, 1]
+
+    @property
+    def y(self):
+        return self.q[:, 2]
+
+    @property
+    def z(self):
+        return self.q[:, 3]
+
+    @property
+    def euler(self):
+        """
+        (N,3) euler angles xyz (roll, pitch, yaw), rads
+        """
+        if self._euler is None:
+            with instrumentation.stage('euler', len(self)):
+                self._set_euler(quaternion_to_euler_batch(self.q).astype(self.q.dtype, copy=False))
+        return self._euler
+
+    @property
+    def euler_degrees(self):
+        """
+        (N,3) euler angles xyz (roll, pitch, yaw), degrees
+        """
+        if self._euler_degrees is None:
+            self._euler_degrees = np.degrees(self.euler)
+            self._euler_degrees.flags.writeable = False
+        return self._euler_degrees
+
+    def _set_euler(self, euler):
+        """
+        Caches euler angles (rads) for this result, read only as they are shared between plots
+        """
+        euler.flags.writeable = False
+        self._euler = euler
+        self._euler_degrees = None
+
+
+# Wrap quaternions as a result
+def as_result(q, time=None):
+    """
+    Returns q as an OrientationResult (q itself if it already is one, arrays are not copied)
+    :param q: OrientationResult, (N,4) array or list of quaternions wxyz
+    :param time: (N,) timestamps, s
+    :return: OrientationResult
+    """
+    if isinstance(q, OrientationResult):
+        return q
+    return OrientationResult(np.asarray(q, dtype=float), time)
+
+
+# Convert a set of results to euler angles together
+def precompute_euler(*results):
+    """
+    Converts every result in the set to euler angles with a single vectorized conversion and caches
+    them on each result, so later plots of any of them reuse the same angles.
+    :param results: OrientationResults
+    :return: None
+    """
+    todo = [result for result in results if result._euler is None]
+    if not todo:
+        return
+    dtype = np.result_type(*[result.q for result in todo])
+    with instrumentation.stage('euler', sum(len(result) for result in todo)):
+        euler = quaternion_to_euler_batch(np.concatenate([result.q for result in todo]).astype(dtype, copy=False))
+    start = 0
+    for result in todo:
+        result._set_euler(euler[start:start + len(result)].astype(result.dtype, copy=False))
+        start += len(result)
+
+
+# Save results to disk
+def save_results(path, results, fmt='npz'):
+    """
+    Writes orientation results to path
+    :param path: output file
+    :param results: dict, stream name -> OrientationResult (all for the same timestamps)
+    :param fmt: 'npz' (arrays time & one (N,4) array per stream) or 'csv' (time + w,x,y,z per stream)
+    :return: None
+    """
+    time = next(iter(results.values())).time
+    if fmt == 'npz':
+        np.savez(path, time=time, **{name: result.q for name, result in results.items()})
+    elif fmt == 'csv':
+        header = ['time'] + ['%s.%s' % (name, axis) for name in results for axis in 'wxyz']
+        columns = np.column_stack([time] + [result.q for result in results.values()])
+        np.savetxt(path, columns, delimiter=',', header=','.join(header), comments='', fmt='%.17g')
+    else:
+        raise ValueError("Unknown output format '%s', expected 'npz' or 'csv'" % fmt)
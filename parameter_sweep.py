@@ -0,0 +1,96 @@
+import os
+import numpy as np
+from multi_device import MultiDeviceTracker
+
+# --- Alpha / Alpha_2 Parameter Sweep ---
+# Runs the drift/yaw corrected filter for a whole grid of (alpha, alpha_2) pairs in one pass over the
+# data: each grid point is treated as a separate device of a MultiDeviceTracker, all fed the same
+# samples. Each pair is scored on how far the orientation drifts from the accelerometer/magnetometer
+# (mean tilt & yaw error) and how hard the corrections pull on it every step (stability).
+
+
+# Run one slice of the grid over the data
+def _sweep_slice(data, alpha, alpha_2):
+    """
+    Runs the filter for grid points (alpha[k], alpha_2[k]) & collects error statistics
+    :param data: IMURecording
+    :param alpha: (G,) accelerometer gains
+    :param alpha_2: (G,) magnetometer gains
+    :return: (G,) mean tilt error, (G,) mean abs yaw error, (G,) mean correction angle per step
+    """
+    n_points = len(alpha)
+    # Normalize by the whole recording like drift_correction/yaw_correction
+    accel_scale = np.sqrt(np.sum(data.accel ** 2, axis=0))
+    mag_scale = np.sqrt(np.sum(data.mag ** 2, axis=0))
+    tracker = MultiDeviceTracker(n_points, alpha, alpha_2, accel_scale, mag_scale)
+
+    tilt_error = np.zeros(n_points)
+    yaw_error = np.zeros(n_points)
+    correction = np.zeros(n_points)
+    # Grid points whose filter diverged (NaN orientation) stop being stepped, their errors stay NaN
+    diverged = np.zeros(n_points, dtype=bool)
+    for i in range(len(data)):
+        tracker.step(data.time[i], np.broadcast_to(data.gyro[i], (n_points, 3)),
+                     np.broadcast_to(data.accel[i], (n_points, 3)), np.broadcast_to(data.mag[i], (n_points, 3)),
+                     ~diverged)
+        diverged |= ~tracker.is_finite()
+        if i == 0:
+            continue
+        # Yaw error wrapped into [-pi, pi]
+        yaw = np.abs((tracker.yaw_error + np.pi) % (2 * np.pi) - np.pi)
+        tilt_error += tracker.tilt_error
+        yaw_error += yaw
+        correction += alpha * tracker.tilt_error + alpha_2 * np.abs(tracker.yaw_error)
+
+    n_steps = max(len(data) - 1, 1)
+    return tilt_error / n_steps, yaw_error / n_steps, correction / n_steps
+
+
+# Sweep alpha / alpha_2 grid
+def parameter_sweep(data, alphas, alpha_2s=(0.0,), stability_weight=1.0, workers=1):
+    """
+    Runs yaw_correction (or drift_correction, alpha_2 = 0) for every (alpha, alpha_2) pair in the grid
+    and scores each pair, lower = better (inf if the filter diverged).
+    score = mean tilt error + mean yaw error + stability_weight * mean correction angle per step
+    :param data: IMURecording
+    :param alphas: accelerometer gains to try
+    :param alpha_2s: magnetometer gains to try (0 = no yaw correction, i.e. drift_correction)
+    :param stability_weight: weight of the correction (stability) term in the score
+    :param workers: number of processes to split the grid between
+    :return: dict of (G,) arrays: alpha, alpha_2, tilt_error, yaw_error, correction, score
+    """
+    alpha, alpha_2 = np.meshgrid(np.asarray(alphas, dtype=float), np.asarray(alpha_2s, dtype=float), indexing='ij')
+    alpha, alpha_2 = alpha.ravel(), alpha_2.ravel()
+
+    workers = min(workers or os.cpu_count() or 1, len(alpha))
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        slices = np.array_split(np.arange(len(alpha)), workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_sweep_slice, [data] * workers,
+                                      [alpha[s] for s in slices], [alpha_2[s] for s in slices]))
+        tilt_error, yaw_error, correction = (np.concatenate(part) for part in zip(*parts))
+    else:
+        tilt_error, yaw_error, correction = _sweep_slice(data, alpha, alpha_2)
+
+    # Pairs where the filter diverged (NaN) score worst
+    score = tilt_error + yaw_error + stability_weight * correction
+    score[np.isnan(score)] = np.inf
+
+    return {'alpha': alpha,
+            'alpha_2': alpha_2,
+            'tilt_error': tilt_error,
+            'yaw_error': yaw_error,
+            'correction': correction,
+            'score': score}
+
+
+# Pick best pair from a sweep
+def best_parameters(sweep):
+    """
+    Returns the (alpha, alpha_2) pair with the lowest score
+    :param sweep: result of parameter_sweep
+    :return: alpha, alpha_2
+    """
+    best = int(np.argmin(sweep['score']))
+    return float(sweep['alpha'][best]), float(sweep['alpha_2'][best])
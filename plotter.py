@@ -2,226 +2,218 @@ import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import mpl_toolkits.mplot3d.axes3d as p3
 import matplotlib.animation as animation
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 from helperFunctions import *
+from orientation_result import as_result, precompute_euler
+from decimation import plot_decimated
+import instrumentation
 
 # --- Plot Stuff ---
 
 
-# 3D Orientation Plot
-def orientation_plot_3d(q1, q2, q3, halfTime, video, time):
+# Basis vectors (X, Y, Z) & their colours in the 3D plot
+BASIS = np.eye(3)
+BASIS_COLOURS = ['r', 'g', 'y']
+PLOT_TITLES = ["Gyro Only", "Gyro + Drift Correction", "Gyro + Drift & Yaw Correction"]
+
+
+# Rotated basis arrows for every frame
+def orientation_arrow_segments(q, arrow_length_ratio=0.3):
     """
-    Produces 3d orientation plot (which has various options)
-    :param q1: set of results -> gyro
-    :param q2: set of results -> + drift correction
-    :param q3: set of results -> + yaw correction
+    Rotates the X, Y & Z basis vectors by each orientation in q (vectorized) & builds the line segments
+    of the 3 arrows (shaft + 2 head lines each) drawn in the 3D plot.
+    :param q: (F,4) orientations wxyz, one per frame
+    :param arrow_length_ratio: length of the arrow heads relative to the shaft
+    :return: (F,9,2,3) line segments per frame, arrows in BASIS order, each shaft, head, head
+    """
+    q = np.asarray(q, dtype=float)
+    # (F,3,3): rotated X, Y, Z per frame
+    tips = point_rotation_by_quaternion_batch(BASIS[None, :, :], q[:, None, :])
+
+    # Head lines point back from the tip, 15 deg either side of the shaft in a plane containing it
+    side = np.cross(tips, tips[:, [1, 2, 0]])
+    side /= np.linalg.norm(side, axis=-1, keepdims=True)
+    c, s = math.cos(math.radians(15)), math.sin(math.radians(15))
+    head_a = tips - arrow_length_ratio * (c * tips + s * side)
+    head_b = tips - arrow_length_ratio * (c * tips - s * side)
+
+    segments = np.empty(tips.shape[:2] + (3, 2, 3))
+    segments[:, :, :, 0] = tips[:, :, None, :]
+    segments[:, :, 0, 1] = 0
+    segments[:, :, 1, 1] = head_a
+    segments[:, :, 2, 1] = head_b
+    return segments.reshape(len(q), 9, 2, 3)
+
+
+# Sample index shown in each frame of the 3D plot
+def playback_frames(time, halfTime, fps):
+    """
+    Picks the sample to show in each animation frame from the timestamps, so playback runs at real
+    (or half) time regardless of how long frames take to draw.
+    :param time: (N,) timestamps, s
     :param halfTime: bool -> T = half time, F = real time
-    :param video: produces a video output instead of a matplotlib interactable plot
-    :return: graph/video of orientations
+    :param fps: animation frames per second
+    :return: (F,) sample index per frame
     """
-    # Set Real Time or Half Time
-    # NB: I am unsure whether these params will produce half/real time on all machines!
-    # These params give me correct results but unsure if this is reproducible for you!
-    # (I have included the option to output a video file below if that helps)
-    if halfTime:
-        jump = 5
-    else:
-        jump = 7
-
-    # Initial Orientations
-    U1 = [1, 0, 0]  # X
-    U2 = [1, 0, 0]  # X
-    U3 = [1, 0, 0]  # X
-    V1 = [0, 1, 0]  # Y
-    V2 = [0, 1, 0]  # Y
-    V3 = [0, 1, 0]  # Y
-    W1 = [0, 0, 1]  # Z
-    W2 = [0, 0, 1]  # Z
-    W3 = [0, 0, 1]  # Z
-
-    # Create figure
-    fig = plt.figure(figsize=plt.figaspect(0.25))
+    time = np.asarray(time, dtype=float)
+    speed = 0.5 if halfTime else 1.0
+    frame_times = np.arange(time[0], time[-1], speed / fps)
+    return np.minimum(np.searchsorted(time, frame_times), len(time) - 1)
+
 
-    # --- Fig 1 ---
-    ax = fig.add_subplot(1, 3, 1, projection='3d')
-    Q1 = ax.quiver(0, 0, 0, U1[0], U1[1], U1[2], color='r', length=1)
-    Q2 = ax.quiver(0, 0, 0, V1[0], V1[1], V1[2], color='g', length=1)
-    Q3 = ax.quiver(0, 0, 0, W1[0], W1[1], W1[2], color='y', length=1)
-
-    # --- Fig 2 ---
-    ax2 = fig.add_subplot(1, 3, 2, projection='3d')
-    Q4 = ax2.quiver(0, 0, 0, U2[0], U2[1], U2[2], color='r', length=1)
-    Q5 = ax2.quiver(0, 0, 0, V2[0], V2[1], V2[2], color='g', length=1)
-    Q6 = ax2.quiver(0, 0, 0, W2[0], W2[1], W2[2], color='y', length=1)
-
-    # --- Fig 3 ---
-    ax3 = fig.add_subplot(1, 3, 3, projection='3d')
-    Q7 = ax3.quiver(0, 0, 0, U3[0], U3[1], U3[2], color='r', length=1)
-    Q8 = ax3.quiver(0, 0, 0, V3[0], V3[1], V3[2], color='g', length=1)
-    Q9 = ax3.quiver(0, 0, 0, W3[0], W3[1], W3[2], color='y', length=1)
-
-    # Get new values for quivers
-    def update_quiver(i, U1, V1, W1, U2, V2, W2, U3, V3, W3):
-        """
-        Function called by animate. Calculates new quivers.
-        :param i: time step
-        :param U1: plot 1, X
-        :param V1: plot 1, Y
-        :param W1: plot 1, Z
-        :param U2: plot 2, X
-        :param V2: plot 2, Y
-        :param W2: plot 2, Z
-        :param U3: plot 3, X
-        :param V3: plot 3, Y
-        :param W3: plot 3, Z
-        :return: None, but updates quivers on plots
-        """
-        # Calc New Vals
-        U1 = point_rotation_by_quaternion(U1, q1[jump * i + 1])
-        V1 = point_rotation_by_quaternion(V1, q1[jump * i + 1])
-        W1 = point_rotation_by_quaternion(W1, q1[jump * i + 1])
-        U2 = point_rotation_by_quaternion(U2, q2[jump * i + 1])
-        V2 = point_rotation_by_quaternion(V2, q2[jump * i + 1])
-        W2 = point_rotation_by_quaternion(W2, q2[jump * i + 1])
-        U3 = point_rotation_by_quaternion(U3, q3[jump * i + 1])
-        V3 = point_rotation_by_quaternion(V3, q3[jump * i + 1])
-        W3 = point_rotation_by_quaternion(W3, q3[jump * i + 1])
-        # Clear Axes
-        ax.clear()
-        ax2.clear()
-        ax3.clear()
-        # Replot Data
-        Q1 = ax.quiver(0, 0, 0, U1[0], U1[1], U1[2], color='r', length=1)
-        Q2 = ax.quiver(0, 0, 0, V1[0], V1[1], V1[2], color='g', length=1)
-        Q3 = ax.quiver(0, 0, 0, W1[0], W1[1], W1[2], color='y', length=1)
-        Q4 = ax2.quiver(0, 0, 0, U2[0], U2[1], U2[2], color='r', length=1)
-        Q5 = ax2.quiver(0, 0, 0, V2[0], V2[1], V2[2], color='g', length=1)
-        Q6 = ax2.quiver(0, 0, 0, W2[0], W2[1], W2[2], color='y', length=1)
-        Q7 = ax3.quiver(0, 0, 0, U3[0], U3[1], U3[2], color='r', length=1)
-        Q8 = ax3.quiver(0, 0, 0, V3[0], V3[1], V3[2], color='g', length=1)
-        Q9 = ax3.quiver(0, 0, 0, W3[0], W3[1], W3[2], color='y', length=1)
-        # Axis Stuff
-        ax.set_title("Gyro Only")
+# Figure with the 3 orientation plots
+def orientation_figure():
+    """
+    Creates the 3D orientation figure: titles, labels & one arrow collection per plot are made once,
+    frames only update the arrow segments & the time in the title.
+    :return: figure, list of 3 Line3DCollections, suptitle Text
+    """
+    fig = plt.figure(figsize=plt.figaspect(0.25))
+    colours = np.repeat(BASIS_COLOURS, 3)
+    arrows = []
+    for n, title in enumerate(PLOT_TITLES):
+        ax = fig.add_subplot(1, 3, n + 1, projection='3d')
+        arrow = Line3DCollection(np.zeros((9, 2, 3)), colors=colours)
+        ax.add_collection3d(arrow)
+        ax.set_xlim(-1, 1)
+        ax.set_ylim(-1, 1)
+        ax.set_zlim(-1, 1)
+        ax.set_title(title)
         ax.set_xlabel("$X$")
         ax.set_ylabel("$Y$")
         ax.set_zlabel("$Z$")
-        ax2.set_title("Gyro + Drift Correction")
-        ax2.set_xlabel("$X$")
-        ax2.set_ylabel("$Y$")
-        ax2.set_zlabel("$Z$")
-        ax3.set_title("Gyro + Drift & Yaw Correction")
-        ax3.set_xlabel("$X$")
-        ax3.set_ylabel("$Y$")
-        ax3.set_zlabel("$Z$")
         ax.set_xticklabels([])
         ax.set_yticklabels([])
         ax.set_zticklabels([])
-        ax2.set_xticklabels([])
-        ax2.set_yticklabels([])
-        ax2.set_zticklabels([])
-        ax3.set_xticklabels([])
-        ax3.set_yticklabels([])
-        ax3.set_zticklabels([])
-        plt.suptitle("t: %ss" % str(round(time[jump * i + 1], 3)))
-
-    # Animate function -> updates the plots
-    anim = animation.FuncAnimation(fig, update_quiver, frames=range(1, int(6958/jump), jump), fargs=(U1, V1, W1, U2, V2, W2, U3, V3, W3),
-                                   interval=100, blit=False, repeat=False)
-
-    # Either show plot, or produce a video using the anim data
-    if not video:
-        plt.show()
-    else:
-        # Output video
+        arrows.append(arrow)
+    suptitle = fig.suptitle("")
+    return fig, arrows, suptitle
+
+
+# Draw one frame of the 3D plot
+def draw_orientation_frame(frame, arrows, suptitle, segments, frame_times):
+    """
+    Updates the arrows & title in place for frame number frame
+    :param frame: frame number
+    :param arrows: 3 Line3DCollections (see orientation_figure)
+    :param suptitle: figure title Text
+    :param segments: per plot (F,9,2,3) arrow segments (see orientation_arrow_segments)
+    :param frame_times: (F,) timestamp shown in each frame
+    :return: updated artists
+    """
+    for arrow, segs in zip(arrows, segments):
+        arrow.set_segments(segs[frame])
+    suptitle.set_text("t: %ss" % str(round(frame_times[frame], 3)))
+    return arrows + [suptitle]
+
+
+# 3D Orientation Plot
+def orientation_plot_3d(q1, q2, q3, halfTime, video, time, fps=20):
+    """
+    Produces 3d orientation plot (which has various options)
+    :param q1: OrientationResult -> gyro
+    :param q2: OrientationResult -> + drift correction
+    :param q3: OrientationResult -> + yaw correction
+    :param halfTime: bool -> T = half time, F = real time
+    :param video: produces a video output (plot.mp4, or PNG frames without ffmpeg) instead of a
+                  matplotlib interactable plot
+    :param time: (N,) timestamps, s
+    :param fps: animation frames per second (video frame rate)
+    :return: graph/video of orientations
+    """
+    if video:
+        # Output video, rendered offscreen across a process pool
+        from video_export import export_orientation_video
         print("Rendering 3D Plot...")
-        # Output vid as mp4
-        writer = animation.writers['ffmpeg']
-        # 5 Fps keeps at real/half time
-        output = writer(fps=5, metadata=dict(artist='Me'), bitrate=1000)
-        anim.save('plot.mp4', writer=output)
+        with instrumentation.stage('plot.video_export', len(time)):
+            export_orientation_video(q1, q2, q3, time, 'plot.mp4', halfTime, fps)
         print("Done. Check folder.")
+        return
+
+    with instrumentation.stage('plot.3d_prepare', len(time)):
+        # Frames are picked from the timestamps, so real/half time doesn't depend on the machine
+        idx = playback_frames(time, halfTime, fps)
+        frame_times = np.asarray(time, dtype=float)[idx]
+
+        # Rotations for every frame are computed up front
+        segments = [orientation_arrow_segments(as_result(q)[idx]) for q in (q1, q2, q3)]
+
+        fig, arrows, suptitle = orientation_figure()
+        draw_orientation_frame(0, arrows, suptitle, segments, frame_times)
+
+        # Animate function -> updates the plots in place. mplot3d projects its artists while drawing the
+        # whole axes, so blitting (redrawing only the changed artists) isn't possible for 3D plots.
+        anim = animation.FuncAnimation(fig, draw_orientation_frame, frames=len(idx),
+                                       fargs=(arrows, suptitle, segments, frame_times),
+                                       interval=1000 / fps, blit=False, repeat=False)
+    plt.show()
 
 
 # Plots single XYZ vals from singular set of results, q
 def orientation_plot_2d(q, val, alpha, alpha_2, time):
     """
-    Plots orientation (XYZ values [degrees]) from list of results, q (WXYZ, rads) over time
-    :param q: list of orientations, quaternions, rad/s
+    Plots orientation (XYZ values [degrees]) from results, q (WXYZ, rads) over time
+    :param q: OrientationResult (or list/array of quaternions), rad/s. Not modified.
     :return: graph of XYZ angle vs Time
     """
-    # Convert to euler & degrees
-    try:
-        for i in range(len(q)):
-            q[i] = quaternion_to_euler(q[i])
-            q[i] = [math.degrees(x) for x in q[i]]
-    except IndexError:
-        pass
-
-    # Plot Triaxial data side by side (singular plot)
-    plt.subplot(1, 1, 1)
-    plt.plot(time, [x[0] for x in q], '-')
-    plt.plot(time, [x[1] for x in q], '-')
-    plt.plot(time, [x[2] for x in q], '-')
-    if val == 0:
-        plt.title('Orientation vs Time - Gyro')
-    elif val == 1:
-        plt.title('Orientation vs Time - Gyro + Accelerometer:\nAlpha = ' + str(alpha))
-    else:
-        plt.title('Orientation vs Time - Gyro + Accelerometer + Magnet:\nAlpha = ' + str(alpha) + ", Alpha2 = " + str(alpha_2))
-
-    plt.legend(['X', 'Y', 'Z'])
-    plt.ylabel('Orientation (deg/s)')
-    plt.xlabel('Time (s)')
+    with instrumentation.stage('plot.orientation_plot_2d', len(time)):
+        # Euler angles in degrees (computed once per result & cached)
+        euler = as_result(q).euler_degrees
+
+        # Plot Triaxial data side by side (singular plot)
+        plt.subplot(1, 1, 1)
+        plot_decimated(plt.gca(), time, [euler[:, 0], euler[:, 1], euler[:, 2]], '-')
+        if val == 0:
+            plt.title('Orientation vs Time - Gyro')
+        elif val == 1:
+            plt.title('Orientation vs Time - Gyro + Accelerometer:\nAlpha = ' + str(alpha))
+        else:
+            plt.title('Orientation vs Time - Gyro + Accelerometer + Magnet:\nAlpha = ' + str(alpha) + ", Alpha2 = " + str(alpha_2))
+
+        plt.legend(['X', 'Y', 'Z'])
+        plt.ylabel('Orientation (deg/s)')
+        plt.xlabel('Time (s)')
     plt.show()
 
 
 # Plot XYZ vals from q1, q2, q3 (gyro, +drift, +yaw)
 def triaxial_orientation(q_1, q_2, q_3, alpha, alpha_2, time):
     """
-    Plots orientation (XYZ values [deg]) from list of results, q (WXYZ, rad) over time
-    :param q_1: quaternion list of results 1
-    :param q_2: quaternion list of results 2
-    :param q_3: quaternion list of results 3
+    Plots orientation (XYZ values [deg]) from results, q (WXYZ, rad) over time
+    :param q_1: OrientationResult 1 (or list/array of quaternions). Not modified.
+    :param q_2: OrientationResult 2 (or list/array of quaternions). Not modified.
+    :param q_3: OrientationResult 3 (or list/array of quaternions). Not modified.
     :return: Graph containing 3 subgraphs, displaying difference in results
     """
-    # Convert to Euler & into Degrees
-    try:
-        for i in range(len(q_1)):
-            q_1[i] = quaternion_to_euler(q_1[i])
-            q_2[i] = quaternion_to_euler(q_2[i])
-            q_3[i] = quaternion_to_euler(q_3[i])
-            q_1[i] = [math.degrees(x) for x in q_1[i]]
-            q_2[i] = [math.degrees(x) for x in q_2[i]]
-            q_3[i] = [math.degrees(x) for x in q_3[i]]
-    except IndexError:
-        pass
-
-    fig, axs = plt.subplots(3, 3, figsize=(20, 20))
-
-    # Plot Triaxial data side by side (singular plot)
-    plt.subplot(3, 1, 1)
-    plt.plot(time, [x[0] for x in q_1], '-')
-    plt.plot(time, [x[1] for x in q_1], '-')
-    plt.plot(time, [x[2] for x in q_1], '-')
-    plt.title('Gyro Integration')
-    plt.legend(['X', 'Y', 'Z'])
-    plt.ylabel('Euler Angle (deg)')
-
-    plt.subplot(3, 1, 2)
-    plt.plot(time, [x[0] for x in q_2], '-')
-    plt.plot(time, [x[1] for x in q_2], '-')
-    plt.plot(time, [x[2] for x in q_2], '-')
-    plt.title('Gyro + Accelerometer - Alpha: %s' % str(alpha))
-    plt.legend(['X', 'Y', 'Z'])
-    plt.ylabel('Euler Angle (deg)')
-
-    plt.subplot(3, 1, 3)
-    plt.plot(time, [x[0] for x in q_3], '-')
-    plt.plot(time, [x[1] for x in q_3], '-')
-    plt.plot(time, [x[2] for x in q_3], '-')
-    plt.title('Gyro + Accelerometer + Magnetometer - Alpha: %s, Alpha_2: %s' % (str(alpha), str(alpha_2)))
-    plt.legend(['X', 'Y', 'Z'])
-    plt.ylabel('Euler Angle (deg)')
-    plt.xlabel('Time (s)')
+    with instrumentation.stage('plot.triaxial_orientation', len(time)):
+        # Euler angles in degrees (computed once per result set & cached)
+        q_1, q_2, q_3 = as_result(q_1), as_result(q_2), as_result(q_3)
+        precompute_euler(q_1, q_2, q_3)
+        q_1 = q_1.euler_degrees
+        q_2 = q_2.euler_degrees
+        q_3 = q_3.euler_degrees
+
+        fig, axs = plt.subplots(3, 3, figsize=(20, 20))
+
+        # Plot Triaxial data side by side (singular plot)
+        plt.subplot(3, 1, 1)
+        plot_decimated(plt.gca(), time, [q_1[:, 0], q_1[:, 1], q_1[:, 2]], '-')
+        plt.title('Gyro Integration')
+        plt.legend(['X', 'Y', 'Z'])
+        plt.ylabel('Euler Angle (deg)')
+
+        plt.subplot(3, 1, 2)
+        plot_decimated(plt.gca(), time, [q_2[:, 0], q_2[:, 1], q_2[:, 2]], '-')
+        plt.title('Gyro + Accelerometer - Alpha: %s' % str(alpha))
+        plt.legend(['X', 'Y', 'Z'])
+        plt.ylabel('Euler Angle (deg)')
+
+        plt.subplot(3, 1, 3)
+        plot_decimated(plt.gca(), time, [q_3[:, 0], q_3[:, 1], q_3[:, 2]], '-')
+        plt.title('Gyro + Accelerometer + Magnetometer - Alpha: %s, Alpha_2: %s' % (str(alpha), str(alpha_2)))
+        plt.legend(['X', 'Y', 'Z'])
+        plt.ylabel('Euler Angle (deg)')
+        plt.xlabel('Time (s)')
 
     plt.show()
 
@@ -241,31 +233,26 @@ def triaxial_plot(gX, gY, gZ, aX, aY, aZ, mX, mY, mZ, time):
     :param mZ: magnetometer Z
     :return: Plot w/ 3 subplots showing gyro, accelerometer & magnetometer data
     """
-    # Plot Triaxial data side by side (singular plot)
-    fig, axs = plt.subplots(3, 3, figsize=(20, 20))
-    plt.subplot(3, 1, 1)
-    plt.plot(time, gX, '-')
-    plt.plot(time, gY, '-')
-    plt.plot(time, gZ, '-')
-    plt.title('Gyroscope')
-    plt.legend(['X', 'Y', 'Z'])
-    plt.ylabel('Angular Rate (deg/s)')
-
-    plt.subplot(3, 1, 2)
-    plt.plot(time, aX, '-')
-    plt.plot(time, aY, '-')
-    plt.plot(time, aZ, '-')
-    plt.title('Accelerometer')
-    plt.legend(['X', 'Y', 'Z'])
-    plt.ylabel(r'Acceleration (m/s$^{2}$)')
-
-    plt.subplot(3, 1, 3)
-    plt.plot(time, mX, '-')
-    plt.plot(time, mY, '-')
-    plt.plot(time, mZ, '-')
-    plt.title('Magnetometer')
-    plt.legend(['X', 'Y', 'Z'])
-    plt.ylabel(r'Gauss ($G$)')
-    plt.xlabel('Time (s)')
+    with instrumentation.stage('plot.triaxial_plot', len(time)):
+        # Plot Triaxial data side by side (singular plot)
+        fig, axs = plt.subplots(3, 3, figsize=(20, 20))
+        plt.subplot(3, 1, 1)
+        plot_decimated(plt.gca(), time, [gX, gY, gZ], '-')
+        plt.title('Gyroscope')
+        plt.legend(['X', 'Y', 'Z'])
+        plt.ylabel('Angular Rate (deg/s)')
+
+        plt.subplot(3, 1, 2)
+        plot_decimated(plt.gca(), time, [aX, aY, aZ], '-')
+        plt.title('Accelerometer')
+        plt.legend(['X', 'Y', 'Z'])
+        plt.ylabel(r'Acceleration (m/s$^{2}$)')
+
+        plt.subplot(3, 1, 3)
+        plot_decimated(plt.gca(), time, [mX, mY, mZ], '-')
+        plt.title('Magnetometer')
+        plt.legend(['X', 'Y', 'Z'])
+        plt.ylabel(r'Gauss ($G$)')
+        plt.xlabel('Time (s)')
 
     plt.show()
@@ -0,0 +1,137 @@
+import argparse
+import sys
+import numpy as np
+from helperFunctions import quaternion_product_batch, quaternion_to_conjugate_batch
+from imu_data import load_recording
+from orientation_engine import GYRO, TILT, YAW, STREAMS, run_filters
+from gyro_integration import gyro_integration
+from drift_correction import drift_correction
+from yaw_correction import yaw_correction
+from jit_kernels import BACKENDS
+
+# --- Precision Mode Error Report ---
+# run_filters(precision=np.float32, renormalize_every=K) computes & stores orientations in float32.
+# This compares its results against the float64 reference filters (gyro_integration, drift_correction,
+# yaw_correction) on a recording: the angle between the orientations, and how far |q| drifts from 1.
+#
+# Two errors are reported per stream: max/mean_error_deg against the reference as it is (float32 rounding +
+# the effect of renormalizing), and precision_error_deg against float64 run with the same
+# renormalization (float32 rounding alone). On IMUData.csv float32 without renormalization stays within
+# ~0.001 deg of the reference, while |q| of the reference itself drifts by ~5%.
+
+
+# Angle between orientations
+def orientation_error(q, q_ref):
+    """
+    Angle of the rotation between two arrays of orientations, each rescaled to unit length first so only
+    the direction of q counts (see norm_error for its length)
+    :param q: (N,4) orientations, wxyz
+    :param q_ref: (N,4) reference orientations, wxyz
+    :return: (N,) angles, rads
+    """
+    q = np.asarray(q, dtype=np.float64)
+    q_ref = np.asarray(q_ref, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    q_ref = q_ref / np.linalg.norm(q_ref, axis=-1, keepdims=True)
+    q_diff = quaternion_product_batch(quaternion_to_conjugate_batch(q_ref), q)
+    # atan2 rather than acos(w), which loses precision for small angles
+    return 2 * np.arctan2(np.linalg.norm(q_diff[..., 1:], axis=-1), np.abs(q_diff[..., 0]))
+
+
+# Deviation of |q| from 1
+def norm_error(q):
+    """
+    :param q: (N,4) orientations, wxyz
+    :return: (N,) ||q| - 1|
+    """
+    return np.abs(np.linalg.norm(np.asarray(q, dtype=np.float64), axis=-1) - 1)
+
+
+# Reference filters (float64, no renormalization)
+def reference_filters(data, alpha, alpha_2, streams=STREAMS, backend='auto'):
+    """
+    :param data: IMURecording
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param streams: which of GYRO, TILT, YAW to produce
+    :param backend: 'auto', 'numba' or 'python' (results are the same)
+    :return: dict, stream name -> (N,4) float64 orientations
+    """
+    filters = {GYRO: lambda: gyro_integration(data, backend=backend),
+               TILT: lambda: drift_correction(data, alpha, backend=backend),
+               YAW: lambda: yaw_correction(data, alpha, alpha_2, backend=backend)}
+    return {stream: filters[stream]().q for stream in streams}
+
+
+# Error report
+def precision_report(data, alpha, alpha_2, streams=STREAMS, precision=np.float32, renormalize_every=0,
+                     backend='auto'):
+    """
+    Runs the filters in the given precision mode & compares them to the float64 reference filters
+    :param data: IMURecording
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param streams: which of GYRO, TILT, YAW to check
+    :param precision: dtype the filters compute in
+    :param renormalize_every: rescale q to unit length every K samples (0 = never)
+    :param backend: 'auto', 'numba' or 'python'
+    :return: dict, stream name -> dict of max_error_deg, mean_error_deg (against the reference),
+             precision_error_deg (max, against float64 with the same renormalization), max_norm_error,
+             reference_norm_error (max ||q| - 1| of the result & of the reference), nbytes,
+             reference_nbytes
+    """
+    reference = reference_filters(data, alpha, alpha_2, streams, backend)
+    results = run_filters(data, alpha, alpha_2, streams, backend=backend, precision=precision,
+                          renormalize_every=renormalize_every)
+    if renormalize_every:
+        same_steps = run_filters(data, alpha, alpha_2, streams, backend=backend, precision=np.float64,
+                                 renormalize_every=renormalize_every)
+        same_steps = {stream: result.q for stream, result in same_steps.items()}
+    else:
+        same_steps = reference
+
+    report = {}
+    for stream in streams:
+        q = results[stream].q
+        error = np.degrees(orientation_error(q, reference[stream]))
+        report[stream] = {
+            'max_error_deg': float(error.max(initial=0)),
+            'mean_error_deg': float(error.mean()) if len(error) else 0.0,
+            'precision_error_deg': float(np.degrees(orientation_error(q, same_steps[stream])).max(initial=0)),
+            'max_norm_error': float(norm_error(q).max(initial=0)),
+            'reference_norm_error': float(norm_error(reference[stream]).max(initial=0)),
+            'nbytes': q.nbytes,
+            'reference_nbytes': reference[stream].nbytes,
+        }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the float32 precision mode to the float64 filters")
+    parser.add_argument('input', nargs='?', default='IMUData.csv', help="IMU CSV file (default: IMUData.csv)")
+    parser.add_argument('--alpha', type=float, default=0.05, help="accelerometer gain (default: 0.05)")
+    parser.add_argument('--alpha-2', type=float, default=0.00001, help="magnetometer gain (default: 0.00001)")
+    parser.add_argument('--filters', nargs='+', choices=STREAMS, default=list(STREAMS),
+                        help="which filters to check (default: all)")
+    parser.add_argument('--renormalize-every', type=int, nargs='+', default=[0], metavar='K',
+                        help="renormalize q every K samples, 0 = never (several values compare them)")
+    parser.add_argument('--backend', choices=BACKENDS, default='auto',
+                        help="filter implementation (default: auto)")
+    args = parser.parse_args(argv)
+
+    data = load_recording(args.input)
+    print("%-6s %6s %14s %14s %14s %12s %12s %10s" % ('filter', 'K', 'max err (deg)', 'mean err (deg)',
+                                                      'f32 err (deg)', '||q|-1|', 'ref ||q|-1|', 'MB'))
+    for k in args.renormalize_every:
+        report = precision_report(data, args.alpha, args.alpha_2, args.filters, renormalize_every=k,
+                                  backend=args.backend)
+        for stream, row in report.items():
+            print("%-6s %6d %14.3g %14.3g %14.3g %12.3g %12.3g %10s" % (
+                stream, k, row['max_error_deg'], row['mean_error_deg'], row['precision_error_deg'],
+                row['max_norm_error'], row['reference_norm_error'],
+                '%.2f/%.2f' % (row['nbytes'] / 1e6, row['reference_nbytes'] / 1e6)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
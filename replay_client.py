@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import bisect
+import json
+import sys
+from time import perf_counter
+import numpy as np
+from imu_data import load_recording
+from ingest_server import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_PUBLISH_PORT, device_name
+
+# --- Replay Client ---
+# Streams a recording to ingest_server.py as if it came from a headset: each row of the CSV is sent as
+# one line, at the recorded rate times speed (speed=0: as fast as possible). devices > 1 replays the
+# same recording over that many connections at once. With output, the client also subscribes to the
+# server & saves the orientations published for its first device, in the layout of
+# orientation_result.save_results (CSV), so they can be compared against main.py's output.
+
+# Lines per UDP datagram are capped so a datagram stays within a typical MTU
+MAX_DATAGRAM = 1400
+# Rows sent per batch when not pacing (speed=0)
+UNPACED_BATCH = 256
+
+
+# Encode rows as ingest lines
+def encode_rows(data):
+    """
+    :param data: IMURecording
+    :return: list of bytes, one 'time,gyro XYZ,accel XYZ,magnet XYZ\\n' line per sample
+    """
+    rows = np.column_stack([data.time, data.gyro, data.accel, data.mag]).tolist()
+    return [(','.join('%.17g' % v for v in row) + '\n').encode('ascii') for row in rows]
+
+
+# Group lines into datagrams
+def _datagrams(lines):
+    datagram = b''
+    for line in lines:
+        if datagram and len(datagram) + len(line) > MAX_DATAGRAM:
+            yield datagram
+            datagram = b''
+        datagram += line
+    if datagram:
+        yield datagram
+
+
+class _Sink(asyncio.DatagramProtocol):
+    """
+    Send-only UDP endpoint
+    """
+
+
+# Stream one device
+async def _send(lines, offsets, host, port, protocol, speed, connected=None):
+    """
+    Sends every line, line i once offsets[i] / speed s have passed
+    :param connected: asyncio.Future, set to this device's name once connected
+    :return: number of lines sent
+    """
+    loop = asyncio.get_running_loop()
+    if protocol == 'udp':
+        transport, _ = await loop.create_datagram_endpoint(_Sink, remote_addr=(host, port))
+        writer = None
+        name = device_name('udp', transport.get_extra_info('sockname'))
+    else:
+        _, writer = await asyncio.open_connection(host, port)
+        name = device_name('tcp', writer.get_extra_info('sockname'))
+    if connected is not None:
+        connected.set_result(name)
+
+    start = perf_counter()
+    i = 0
+    try:
+        while i < len(lines):
+            if speed > 0:
+                # Every row that is due by now
+                end = max(bisect.bisect_right(offsets, (perf_counter() - start) * speed), i + 1)
+            else:
+                end = min(i + UNPACED_BATCH, len(lines))
+            if writer is None:
+                for datagram in _datagrams(lines[i:end]):
+                    transport.sendto(datagram)
+            else:
+                writer.write(b''.join(lines[i:end]))
+                await writer.drain()
+            i = end
+            if i < len(lines):
+                await asyncio.sleep(max(offsets[i] / speed - (perf_counter() - start), 0) if speed > 0 else 0)
+    finally:
+        if writer is None:
+            transport.close()
+        else:
+            writer.close()
+            await writer.wait_closed()
+    return i
+
+
+# Collect the orientations published for a device
+async def _subscribe(host, publish_port, device, n_expected, subscribed, quiet=2.0):
+    """
+    :param device: asyncio.Future of the device name to collect
+    :param n_expected: stop after this many orientations
+    :param subscribed: asyncio.Event set once connected
+    :param quiet: or stop after this many seconds without one
+    :return: list of (time, w, x, y, z)
+    """
+    reader, writer = await asyncio.open_connection(host, publish_port)
+    subscribed.set()
+    name = (await device).encode('ascii') + b','
+    rows = []
+    try:
+        while len(rows) < n_expected:
+            line = await asyncio.wait_for(reader.readline(), quiet)
+            if not line:
+                break
+            if line.startswith(name):
+                rows.append([float(v) for v in line[len(name):].split(b',')])
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return rows
+
+
+# Replay a recording
+async def replay(path, host=DEFAULT_HOST, port=DEFAULT_PORT, protocol='udp', speed=1.0, devices=1,
+                 output=None, publish_port=DEFAULT_PUBLISH_PORT):
+    """
+    Streams a recording to the ingest server
+    :param path: IMU CSV file
+    :param host: server address
+    :param port: server ingest port
+    :param protocol: 'udp' or 'tcp'
+    :param speed: playback speed, 1 = recorded rate, 0 = as fast as possible
+    :param devices: number of simultaneous devices replaying the recording
+    :param output: CSV to save the orientations published for the first device to (None = don't subscribe)
+    :param publish_port: server publish port (with output)
+    :return: dict: devices, samples_sent, seconds, samples_per_s (+ samples_received with output)
+    """
+    data = load_recording(path)
+    lines = encode_rows(data)
+    offsets = (data.time - data.time[0]).tolist() if len(data) else []
+
+    connected = asyncio.get_running_loop().create_future()
+    collector = None
+    if output:
+        subscribed = asyncio.Event()
+        collector = asyncio.ensure_future(_subscribe(host, publish_port, connected, len(lines), subscribed))
+        await subscribed.wait()
+
+    start = perf_counter()
+    sent = await asyncio.gather(*[_send(lines, offsets, host, port, protocol, speed, connected if k == 0 else None)
+                                  for k in range(devices)])
+    seconds = perf_counter() - start
+    summary = {'devices': devices, 'samples_sent': sum(sent), 'seconds': seconds,
+               'samples_per_s': sum(sent) / seconds if seconds > 0 else 0.0}
+
+    if collector is not None:
+        rows = await collector
+        summary['samples_received'] = len(rows)
+        header = 'time,yaw.w,yaw.x,yaw.y,yaw.z'
+        np.savetxt(output, np.array(rows).reshape(-1, 5), delimiter=',', header=header, comments='', fmt='%.17g')
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream an IMU CSV to ingest_server.py")
+    parser.add_argument('input', nargs='?', default='IMUData.csv', help="IMU CSV file (default: IMUData.csv)")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="server address (default: %s)" % DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="ingest port (default: %d)" % DEFAULT_PORT)
+    parser.add_argument('--protocol', choices=('udp', 'tcp'), default='udp', help="(default: udp)")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="playback speed, 1 = recorded rate, 0 = as fast as possible (default: 1)")
+    parser.add_argument('--devices', type=int, default=1, help="simultaneous devices to simulate (default: 1)")
+    parser.add_argument('-o', '--output', help="subscribe & save the first device's orientations to this CSV")
+    parser.add_argument('--publish-port', type=int, default=DEFAULT_PUBLISH_PORT,
+                        help="server publish port (default: %d)" % DEFAULT_PUBLISH_PORT)
+    args = parser.parse_args(argv)
+
+    summary = asyncio.run(replay(args.input, args.host, args.port, args.protocol, args.speed, args.devices,
+                                 args.output, args.publish_port))
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+from orientation_engine import GYRO, TILT, YAW, STREAMS, run_filters
+from orientation_result import OrientationResult
+
+# --- Filter Result Cache ---
+# Stores the (N,4) orientation arrays of previous runs on disk, so rerunning main.py on the same data
+# with the same alpha values (e.g. to tweak plots) doesn't recompute them. Entries are keyed by a hash
+# of the input file's contents + filter kind + the alphas that filter uses (+ the precision mode, if
+# not the default float64 without renormalization) + CODE_VERSION, and the least recently used entries
+# are evicted once the cache grows past its size limit.
+
+# Bump when a change to the filters changes their results, so old entries are no longer used
+CODE_VERSION = '1'
+DEFAULT_CACHE_DIR = '.orientation_cache'
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+class ResultCache:
+    """
+    On-disk, size bounded LRU cache of orientation arrays (one .npy file per entry)
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param cache_dir: directory the entries are stored in
+        :param max_bytes: total size above which least recently used entries are evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._hash_index = os.path.join(cache_dir, 'file_hashes.json')
+
+    def file_hash(self, path):
+        """
+        sha256 of the file's contents. Remembered per (path, mtime, size) so unchanged files aren't
+        re-read on every run.
+        :param path: input file
+        :return: hex digest
+        """
+        stat = os.stat(path)
+        stamp = '%s:%d:%d' % (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        try:
+            with open(self._hash_index) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            hashes = {}
+        if stamp in hashes:
+            return hashes[stamp]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        hashes = {key: value for key, value in hashes.items() if not key.startswith(os.path.abspath(path) + ':')}
+        hashes[stamp] = digest.hexdigest()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._hash_index, 'w') as f:
+            json.dump(hashes, f)
+        return hashes[stamp]
+
+    def key(self, path, kind, alpha=None, alpha_2=None, precision=np.float64, renormalize_every=0):
+        """
+        Cache key for the results of filter kind on input file path
+        :param path: input file
+        :param kind: GYRO, TILT or YAW
+        :param alpha: accelerometer gain (ignored for GYRO)
+        :param alpha_2: magnetometer gain (only used for YAW)
+        :param precision: dtype the filter computed in
+        :param renormalize_every: renormalization interval the filter ran with (0 = never)
+        :return: hex key
+        """
+        params = {GYRO: (), TILT: (alpha,), YAW: (alpha, alpha_2)}[kind]
+        mode = []
+        if np.dtype(precision) != np.float64 or renormalize_every:
+            mode = ['%s/%d' % (np.dtype(precision).name, renormalize_every)]
+        text = '|'.join([self.file_hash(path), kind] + [repr(float(p)) for p in params] + mode + [CODE_VERSION])
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, key):
+        """
+        :param key: cache key
+        :return: (N,4) array, or None if not cached
+        """
+        path = self._entry(key)
+        try:
+            q = np.load(path)
+        except (OSError, ValueError):
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return q
+
+    def put(self, key, q):
+        """
+        Stores an (N,4) array & evicts least recently used entries if over the size limit
+        :param key: cache key
+        :param q: (N,4) array
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._entry(key) + '.tmp.npy'
+        np.save(tmp_path, np.asarray(q))
+        os.replace(tmp_path, self._entry(key))
+        self.evict()
+
+    def _entries(self):
+        """
+        :return: list of (last used, size, path) of all entries
+        """
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.npy') and not name.endswith('.tmp.npy'):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(self.cache_dir, name)))
+        return entries
+
+    def size(self):
+        """
+        :return: total size of all entries, bytes
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache is within max_bytes
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def invalidate(self):
+        """
+        Removes every entry
+        :return: number of entries removed
+        """
+        entries = self._entries()
+        for _, _, path in entries:
+            os.remove(path)
+        if os.path.exists(self._hash_index):
+            os.remove(self._hash_index)
+        return len(entries)
+
+
+# run_filters, reusing cached results
+def cached_run_filters(path, data, alpha, alpha_2, streams=STREAMS, cache=None, backend='auto',
+                       precision=np.float64, renormalize_every=0):
+    """
+    Same as orientation_engine.run_filters, but streams already in the cache are loaded instead of
+    computed, and newly computed ones are stored.
+    :param path: input file data was loaded from (its contents are part of the key)
+    :param data: IMURecording
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param streams: which of GYRO, TILT, YAW to produce
+    :param cache: ResultCache (default: ResultCache())
+    :param backend: 'auto', 'numba' or 'python' (see jit_kernels.py, results are the same)
+    :param precision: dtype the filters compute in, np.float64 or np.float32
+    :param renormalize_every: rescale q to unit length every K samples (0 = never)
+    :return: dict, stream name -> OrientationResult
+    """
+    cache = cache or ResultCache()
+    keys = {stream: cache.key(path, stream, alpha, alpha_2, precision, renormalize_every) for stream in streams}
+    results = {}
+    for stream in streams:
+        q = cache.get(keys[stream])
+        if q is not None and len(q) == len(data):
+            results[stream] = OrientationResult(q, data.time)
+
+    missing = [stream for stream in streams if stream not in results]
+    if missing:
+        computed = run_filters(data, alpha, alpha_2, missing, backend=backend, precision=precision,
+                               renormalize_every=renormalize_every)
+        for stream in missing:
+            cache.put(keys[stream], computed[stream].q)
+        results.update(computed)
+    return {stream: results[stream] for stream in streams}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the filter result cache")
+    parser.add_argument('command', choices=('info', 'invalidate'), help="show cache size, or remove every entry")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="cache directory (default: %s)" % DEFAULT_CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache_dir)
+    if args.command == 'info':
+        print("%s: %d entries, %.1f MB" % (args.cache_dir, len(cache._entries()), cache.size() / 1e6))
+    else:
+        print("Removed %d entries from %s" % (cache.invalidate(), args.cache_dir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
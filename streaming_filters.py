@@ -0,0 +1,233 @@
+import math
+
+# --- Streaming Filters ---
+# Stateful, sample-by-sample versions of gyro_integration, drift_correction & yaw_correction for
+# real-time use. Each filter only keeps the current orientation, the last timestamp and (for yaw) the
+# reference frame, and update() does a fixed amount of float arithmetic per sample.
+#
+# The batch filters normalize each accel/magnet axis by its magnitude over the whole recording, which
+# needs the full recording up front. The streaming filters instead normalize each reading on its own
+# (unit vector) by default. Passing the per-axis magnitudes of a recording as accel_scale/mag_scale
+# reproduces the batch normalization (& results) exactly.
+
+
+# Quaternion Product A * B (on floats, see helperFunctions.quaternion_product)
+def _qmul(Wa, Xa, Ya, Za, Wb, Xb, Yb, Zb):
+    """
+    Returns the quaternion product
+    :return: quaternion product wxyz
+    """
+    return (-Xa * Xb - Ya * Yb - Za * Zb + Wa * Wb,
+            Xa * Wb + Ya * Zb - Za * Yb + Wa * Xb,
+            -Xa * Zb + Ya * Wb + Za * Xb + Wa * Yb,
+            Xa * Yb - Ya * Xb + Za * Wb + Wa * Zb)
+
+
+# Rotate vector into global frame: q * [0, v] * q^-1
+def _to_global(W, X, Y, Z, vx, vy, vz):
+    """
+    Transforms vector v into the global frame using orientation q
+    :return: transformed vector xyz
+    """
+    pw, px, py, pz = _qmul(0, vx, vy, vz, W, -X, -Y, -Z)
+    return _qmul(W, X, Y, Z, pw, px, py, pz)[1:]
+
+
+# Normalize a single reading
+def _normalize(v, scale):
+    """
+    Normalizes reading v, either to a unit vector (scale=None) or by fixed per-axis magnitudes
+    :param v: xyz reading
+    :param scale: per-axis magnitudes xyz, or None
+    :return: normalized xyz
+    """
+    x, y, z = v
+    if scale is None:
+        mag = math.sqrt(x * x + y * y + z * z)
+        if mag == 0:
+            return 0.0, 0.0, 0.0
+        return x / mag, y / mag, z / mag
+    sx, sy, sz = scale
+    return (x / sx if sx != 0 else 0.0,
+            y / sy if sy != 0 else 0.0,
+            z / sz if sz != 0 else 0.0)
+
+
+class GyroIntegrator:
+    """
+    Streaming gyro integration (see gyro_integration)
+    """
+    __slots__ = ('w', 'x', 'y', 'z', 'last_time')
+
+    def __init__(self):
+        # init orientation = identity quaternion : [w, x, y, z]
+        self.w, self.x, self.y, self.z = 1.0, 0.0, 0.0, 0.0
+        self.last_time = None
+
+    @property
+    def q(self):
+        """
+        Current orientation, wxyz
+        """
+        return self.w, self.x, self.y, self.z
+
+    def _first(self, t, gyro, accel, mag):
+        """
+        Handles the first sample, @ t=0, orientation = [1,0,0,0]
+        """
+        self.last_time = t
+
+    def _integrate(self, t, gyro):
+        """
+        Advances the orientation by the gyro reading (deg/s) over the time since the last sample
+        """
+        g_x, g_y, g_z = math.radians(gyro[0]), math.radians(gyro[1]), math.radians(gyro[2])
+        # Calc l, magnitude of gyro reading & theta
+        l = math.sqrt(g_x ** 2 + g_y ** 2 + g_z ** 2)
+        theta = l * (t - self.last_time)
+        self.last_time = t
+        if l == 0:
+            # 0 reading (e.g. a still, quantised gyro) = no rotation
+            return
+        # Calc quaternion (normalized gyro reading as axis)
+        s = math.sin(theta / 2)
+        self.w, self.x, self.y, self.z = _qmul(self.w, self.x, self.y, self.z,
+                                               math.cos(theta / 2), g_x / l * s, g_y / l * s, g_z / l * s)
+
+    def update(self, t, gyro, accel=None, mag=None):
+        """
+        Processes one sample
+        :param t: timestamp, s
+        :param gyro: gyroscope XYZ, deg/s
+        :param accel: accelerometer XYZ (unused)
+        :param mag: magnetometer XYZ (unused)
+        :return: new orientation, wxyz
+        """
+        if self.last_time is None:
+            self._first(t, gyro, accel, mag)
+        else:
+            self._integrate(t, gyro)
+        return self.w, self.x, self.y, self.z
+
+
+class TiltCorrector(GyroIntegrator):
+    """
+    Streaming gyro integration + pitch & roll drift correction (see drift_correction)
+    """
+    __slots__ = ('alpha', 'accel_scale')
+
+    def __init__(self, alpha, accel_scale=None):
+        """
+        :param alpha: accelerometer gain
+        :param accel_scale: per-axis accelerometer magnitudes, None = normalize each reading
+        """
+        GyroIntegrator.__init__(self)
+        self.alpha = alpha
+        self.accel_scale = accel_scale
+
+    def _correct_tilt(self, accel):
+        """
+        Pitch & Roll Drift Correction (Accelerometer)
+        """
+        a_x, a_y, a_z = _normalize(accel, self.accel_scale)
+        # Transform accelerometer to global frame
+        h_x, h_y, h_z = _to_global(self.w, self.x, self.y, self.z, a_x, a_y, a_z)
+        mag_h = math.sqrt(h_x ** 2 + h_y ** 2 + h_z ** 2)
+        if mag_h == 0:
+            # 0 reading, no direction to correct towards
+            return
+        # Calc angle between a^xyz & (0, 0, 1) - Z axis is up
+        phi = math.acos(h_z / mag_h)
+        # Tilt axis (y, -x, 0), obtain q(t, -alpha*phi)
+        theta = - self.alpha * phi
+        s = math.sin(theta / 2)
+        self.w, self.x, self.y, self.z = _qmul(self.w, self.x, self.y, self.z,
+                                               math.cos(theta / 2), h_y * s, -h_x * s, 0.0)
+
+    def update(self, t, gyro, accel=None, mag=None):
+        """
+        Processes one sample
+        :param t: timestamp, s
+        :param gyro: gyroscope XYZ, deg/s
+        :param accel: accelerometer XYZ
+        :param mag: magnetometer XYZ (unused)
+        :return: new orientation, wxyz
+        """
+        if self.last_time is None:
+            self._first(t, gyro, accel, mag)
+        else:
+            self._integrate(t, gyro)
+            self._correct_tilt(accel)
+        return self.w, self.x, self.y, self.z
+
+
+class YawCorrector(TiltCorrector):
+    """
+    Streaming gyro integration + pitch & roll drift correction + yaw drift correction (see
+    yaw_correction). The reference frame (q_ref, m_ref) is taken from the first sample.
+    """
+    __slots__ = ('alpha_2', 'mag_scale', 'q_ref', 'm_ref', 'theta_r')
+
+    def __init__(self, alpha, alpha_2, accel_scale=None, mag_scale=None):
+        """
+        :param alpha: accelerometer gain
+        :param alpha_2: magnetometer gain
+        :param accel_scale: per-axis accelerometer magnitudes, None = normalize each reading
+        :param mag_scale: per-axis magnetometer magnitudes, None = normalize each reading
+        """
+        TiltCorrector.__init__(self, alpha, accel_scale)
+        self.alpha_2 = alpha_2
+        self.mag_scale = mag_scale
+        self.q_ref = None
+        self.m_ref = None
+        self.theta_r = None
+
+    def _first(self, t, gyro, accel, mag):
+        """
+        Handles the first sample, sets the reference frame
+        """
+        self.last_time = t
+        self.set_reference(self.q, _normalize(mag, self.mag_scale))
+
+    def set_reference(self, q_ref, m_ref):
+        """
+        Sets the reference orientation & magnetometer reading the yaw is corrected towards
+        :param q_ref: reference orientation, wxyz
+        :param m_ref: normalized reference magnetometer reading, xyz
+        """
+        self.q_ref = tuple(q_ref)
+        self.m_ref = tuple(m_ref)
+        # m_ref' projected into YX plane, constant for a given reference
+        m_x, m_y, m_z = _to_global(*(self.q_ref + self.m_ref))
+        self.theta_r = math.atan2(m_y, m_x)
+
+    def _correct_yaw(self, mag):
+        """
+        Yaw Drift Correction (Magnetometer)
+        """
+        m_x, m_y, m_z = _normalize(mag, self.mag_scale)
+        # Calculate m' & project into YX plane
+        n_x, n_y, n_z = _to_global(self.w, self.x, self.y, self.z, m_x, m_y, m_z)
+        theta = math.atan2(n_y, -n_x)
+        # Correct for drift using complementary filter
+        half = - self.alpha_2 * (theta - self.theta_r) / 2
+        s = math.sin(half)
+        self.w, self.x, self.y, self.z = _qmul(self.w, self.x, self.y, self.z,
+                                               math.cos(half), 0.0, 0.0, s)
+
+    def update(self, t, gyro, accel=None, mag=None):
+        """
+        Processes one sample
+        :param t: timestamp, s
+        :param gyro: gyroscope XYZ, deg/s
+        :param accel: accelerometer XYZ
+        :param mag: magnetometer XYZ
+        :return: new orientation, wxyz
+        """
+        if self.last_time is None:
+            self._first(t, gyro, accel, mag)
+        else:
+            self._integrate(t, gyro)
+            self._correct_tilt(accel)
+            self._correct_yaw(mag)
+        return self.w, self.x, self.y, self.z
@@ -0,0 +1,92 @@
+import numpy as np
+from imu_data import CSV_COLUMNS
+from orientation_engine import GYRO, TILT, YAW, STREAMS
+from streaming_filters import GyroIntegrator, TiltCorrector, YawCorrector
+
+# --- Chunked Streaming Ingestion ---
+# Filters CSVs of any length in constant memory: the CSV is read in chunks, each chunk's samples are
+# fed to the streaming filters (see streaming_filters.py) and the orientations are written out before
+# the next chunk is read.
+#
+# Normalization: the batch filters divide each accel/magnet axis by its magnitude over the whole
+# recording. With normalization='recording' those magnitudes are accumulated chunk by chunk in a first
+# pass over the file (sum of squares per axis), giving exactly the batch filters' results. With
+# normalization='sample' each reading is normalized on its own and the file is only read once.
+
+
+# Read CSV in chunks
+def iter_chunks(path, chunksize=100000):
+    """
+    Reads an IMU CSV chunk by chunk
+    :param path: IMU CSV file
+    :param chunksize: rows per chunk
+    :return: generator of (n,10) float64 arrays, columns as imu_data.CSV_COLUMNS
+    """
+    import pandas as pd
+    with pd.read_csv(path, usecols=CSV_COLUMNS, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk[CSV_COLUMNS].to_numpy(dtype=np.float64)
+
+
+# First pass: per-axis magnitudes
+def column_scales(path, chunksize=100000):
+    """
+    Calculates the per-axis magnitudes normalize() divides accel & magnet data by, in constant memory
+    :param path: IMU CSV file
+    :param chunksize: rows per chunk
+    :return: number of rows, accel_scale (3,), mag_scale (3,)
+    """
+    n_rows = 0
+    sum_squares = np.zeros(6)
+    for chunk in iter_chunks(path, chunksize):
+        n_rows += len(chunk)
+        sum_squares += np.sum(chunk[:, 4:10] ** 2, axis=0)
+    scales = np.sqrt(sum_squares)
+    return n_rows, scales[:3], scales[3:]
+
+
+# Filter a CSV chunk by chunk
+def stream_filters(path, output, alpha, alpha_2, streams=STREAMS, normalization='recording',
+                   chunksize=100000):
+    """
+    Runs the chosen filters over an IMU CSV in constant memory, writing results as it goes. The
+    output CSV has the same layout as orientation_result.save_results: time, then w,x,y,z per stream.
+    :param path: IMU CSV file
+    :param output: output CSV file
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param streams: which of GYRO, TILT, YAW to produce
+    :param normalization: 'recording' (two passes, same results as the batch filters) or 'sample'
+    :param chunksize: rows per chunk
+    :return: number of samples processed
+    """
+    for stream in streams:
+        if stream not in STREAMS:
+            raise ValueError("Unknown stream '%s', expected one of %s" % (stream, ", ".join(STREAMS)))
+    if normalization == 'recording':
+        n_rows, accel_scale, mag_scale = column_scales(path, chunksize)
+        accel_scale, mag_scale = tuple(accel_scale.tolist()), tuple(mag_scale.tolist())
+    elif normalization == 'sample':
+        accel_scale = mag_scale = None
+    else:
+        raise ValueError("Unknown normalization '%s', expected 'recording' or 'sample'" % normalization)
+
+    make = {GYRO: lambda: GyroIntegrator(),
+            TILT: lambda: TiltCorrector(alpha, accel_scale),
+            YAW: lambda: YawCorrector(alpha, alpha_2, accel_scale, mag_scale)}
+    updates = [make[stream]().update for stream in streams]
+
+    n_samples = 0
+    header = ['time'] + ['%s.%s' % (stream, axis) for stream in streams for axis in 'wxyz']
+    with open(output, 'w') as f:
+        f.write(','.join(header) + '\n')
+        for chunk in iter_chunks(path, chunksize):
+            out = np.empty((len(chunk), 1 + 4 * len(updates)))
+            out[:, 0] = chunk[:, 0]
+            for i, (t, g_x, g_y, g_z, a_x, a_y, a_z, m_x, m_y, m_z) in enumerate(chunk.tolist()):
+                gyro, accel, mag = (g_x, g_y, g_z), (a_x, a_y, a_z), (m_x, m_y, m_z)
+                for n, update in enumerate(updates):
+                    out[i, 1 + 4 * n:5 + 4 * n] = update(t, gyro, accel, mag)
+            np.savetxt(f, out, delimiter=',', fmt='%.17g')
+            n_samples += len(chunk)
+    return n_samples
@@ -0,0 +1,139 @@
+import os
+import shutil
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# --- Parallel Video Export ---
+# Renders the 3D orientation plot (see plotter.orientation_plot_3d) offscreen with the Agg backend.
+# The frame range is split across a process pool, each worker draws its frames into raw RGB buffers
+# and the frames are streamed, in order, to a single ffmpeg process. When ffmpeg isn't installed the
+# workers save their frames as a PNG sequence themselves, so encoding the PNGs is parallel too.
+
+# Per worker process state (set by _init_worker)
+_worker = {}
+
+
+# Set up a render worker
+def _init_worker(segments, frame_times, frame_dir=None):
+    """
+    Creates the (offscreen) figure a worker process draws its frames with
+    :param segments: per plot (F,9,2,3) arrow segments
+    :param frame_times: (F,) timestamp shown in each frame
+    :param frame_dir: directory to save the frames to as PNGs (None = return them as raw RGB)
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.image
+    import plotter
+    fig, arrows, suptitle = plotter.orientation_figure()
+    _worker.update(fig=fig, arrows=arrows, suptitle=suptitle, segments=segments, frame_times=frame_times,
+                   draw=plotter.draw_orientation_frame, frame_dir=frame_dir, imsave=matplotlib.image.imsave)
+
+
+# Render a range of frames
+def _render_frames(frames):
+    """
+    Renders frames (start, stop) into raw RGB buffers, or PNG files with a frame_dir
+    :param frames: (start, stop) frame numbers
+    :return: width, height, list of RGB frames (bytes) or of PNG paths
+    """
+    fig = _worker['fig']
+    frame_dir = _worker['frame_dir']
+    rendered = []
+    for frame in range(*frames):
+        _worker['draw'](frame, _worker['arrows'], _worker['suptitle'], _worker['segments'], _worker['frame_times'])
+        fig.canvas.draw()
+        rgba = np.asarray(fig.canvas.buffer_rgba())
+        if frame_dir is None:
+            rendered.append(rgba[:, :, :3].tobytes())
+        else:
+            png = os.path.join(frame_dir, 'frame_%06d.png' % frame)
+            _worker['imsave'](png, rgba[:, :, :3])
+            rendered.append(png)
+    width, height = fig.canvas.get_width_height()
+    return width, height, rendered
+
+
+# Start ffmpeg reading raw frames from stdin
+def _open_ffmpeg(ffmpeg, path, width, height, fps):
+    """
+    :return: ffmpeg process, write frames to its stdin
+    """
+    command = [ffmpeg, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', path]
+    return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+
+# Export the 3D orientation plot as a video
+def export_orientation_video(q1, q2, q3, time, path='plot.mp4', halfTime=False, fps=20, workers=None,
+                             frames_per_task=20):
+    """
+    Renders the 3D orientation plot offscreen across a process pool & writes it as a video
+    :param q1: OrientationResult -> gyro
+    :param q2: OrientationResult -> + drift correction
+    :param q3: OrientationResult -> + yaw correction
+    :param time: (N,) timestamps, s
+    :param path: output video path
+    :param halfTime: bool -> T = half time, F = real time
+    :param fps: video frame rate
+    :param workers: number of render processes (default: number of CPUs)
+    :param frames_per_task: frames rendered per task sent to a worker
+    :return: path written (the video, or the directory of PNG frames if ffmpeg isn't installed)
+    """
+    from plotter import playback_frames, orientation_arrow_segments
+    from orientation_result import as_result
+
+    idx = playback_frames(time, halfTime, fps)
+    frame_times = np.asarray(time, dtype=float)[idx]
+    segments = [orientation_arrow_segments(as_result(q)[idx]) for q in (q1, q2, q3)]
+    tasks = [(start, min(start + frames_per_task, len(idx))) for start in range(0, len(idx), frames_per_task)]
+    workers = workers or os.cpu_count() or 1
+
+    ffmpeg = shutil.which('ffmpeg')
+    frame_dir = None
+    if ffmpeg is None:
+        frame_dir = os.path.splitext(path)[0] + '_frames'
+        os.makedirs(frame_dir, exist_ok=True)
+        print("ffmpeg not found, writing frames to %s" % frame_dir)
+    process = None
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(segments, frame_times, frame_dir)) as executor:
+            # Keep a bounded number of tasks in flight, results are consumed in frame order
+            pending = deque()
+            next_task = 0
+            try:
+                while next_task < len(tasks) or pending:
+                    while next_task < len(tasks) and len(pending) < 2 * workers:
+                        pending.append(executor.submit(_render_frames, tasks[next_task]))
+                        next_task += 1
+                    width, height, rendered = pending.popleft().result()
+                    if frame_dir is None:
+                        if process is None:
+                            process = _open_ffmpeg(ffmpeg, path, width, height, fps)
+                        for rgb in rendered:
+                            process.stdin.write(rgb)
+            finally:
+                # On failure, don't wait for the frames still queued
+                for future in pending:
+                    future.cancel()
+
+        if process is not None:
+            process.stdin.close()
+            if process.wait() != 0:
+                raise RuntimeError("ffmpeg exited with code %d" % process.returncode)
+            return path
+        return frame_dir
+    finally:
+        # A failed render (or write) leaves ffmpeg waiting for frames, stop it rather than leak it
+        if process is not None and process.returncode is None:
+            process.kill()
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
@@ -1,55 +1,76 @@
-import pandas as pd
+from time import perf_counter
 from helperFunctions import *
+import instrumentation
+import jit_kernels
+from orientation_result import OrientationResult
 
 
 # + Yaw correction
-def yaw_correction(alpha, alpha_2):
-    # Import data from CSV
-    data = pd.read_csv("IMUData.csv")
-
-    # Columns are: (Gyroscope) X, Y, Z | (Accelerometer) X, Y, Z | (Magnetometer) X, Y, Z
-    # Vals init in deg / s (Gyroscope), m / s^2 (accelerometer), G [gauss] (magnetometer)
-    time = data['time'].tolist()
-    gyro_X = data['gyroscope.X'].tolist()
-    gyro_Y = data['gyroscope.Y'].tolist()
-    gyro_Z = data['gyroscope.Z'].tolist()
-    accel_X = data['accelerometer.X'].tolist()
-    accel_Y = data['accelerometer.Y'].tolist()
-    accel_Z = data['accelerometer.Z'].tolist()
-    magnet_X = data['magnetometer.X'].tolist()
-    magnet_Y = data['magnetometer.Y'].tolist()
-    magnet_Z = data['magnetometer.Z'].tolist()
-
-    # Convert gyro data (angular velocity) : deg/s -> rad/s
-    gyro_X, gyro_Y, gyro_Z = convert_deg_to_rads(gyro_X, gyro_Y, gyro_Z)
-
-    # Normalize accel & magnet data
-    accel_X, accel_Y, accel_Z = normalize(accel_X, accel_Y, accel_Z)
-    magnet_X, magnet_Y, magnet_Z = normalize(magnet_X, magnet_Y, magnet_Z)
+def yaw_correction(data, alpha, alpha_2, dtype=np.float64, backend='auto'):
+    """
+    Gyro integration + pitch & roll drift correction + yaw drift correction from the magnetometer
+    :param data: IMURecording (see imu_data.load_recording)
+    :param alpha: accelerometer gain
+    :param alpha_2: magnetometer gain
+    :param dtype: dtype results are stored in (float64 or float32)
+    :param backend: 'auto' (compiled kernel if numba is installed), 'numba' or 'python'
+    :return: OrientationResult, (N,4) orientations wxyz
+    """
+    if jit_kernels.use_jit(backend):
+        with instrumentation.stage('yaw_correction.kernel', len(data)):
+            q = jit_kernels.run_kernel(data, jit_kernels.YAW_MODE, alpha, alpha_2, dtype=dtype)
+        return OrientationResult(q, data.time)
+
+    # Data is pre-converted once per recording: gyro -> rad/s, accel & magnet -> normalized
+    time = data.time.tolist()
+    gyro_X, gyro_Y, gyro_Z = data.gyro_rads.T.tolist()
+    accel_X, accel_Y, accel_Z = data.accel_normalized.T.tolist()
+    magnet_X, magnet_Y, magnet_Z = data.mag_normalized.T.tolist()
 
     # init orientation = identity quaternion : [w, x, y, z]
-    q = [[1, 0, 0, 0]]
+    q = np.empty((len(time), 4), dtype=dtype)
+    q[0] = q_prev = [1, 0, 0, 0]
 
     # Get initial m_ref and q_ref vals
     m_ref = [0, magnet_X[0], magnet_Y[0], magnet_Z[0]]
-    q_ref = q[0]
+    q_ref = q_prev
+
+    # q_ref & m_ref never change, so m_ref' projected into YX plane is calculated once
+    q_ref_inverse = quaternion_to_conjugate(q_ref)
+    m_ref_next = quaternion_product(q_ref, quaternion_product(m_ref, q_ref_inverse))[1:]
+    theta_r = math.atan2(m_ref_next[1], m_ref_next[0])
+
+    # Per-step timers, only run while profiling (see instrumentation.py)
+    timed = instrumentation.enabled()
+    gyro_time = tilt_time = yaw_time = 0.0
 
     # Start @ t=1 as @ t=0, orientation = [1,0,0,0]
     for i in range(1, len(gyro_X)):
+        if timed:
+            tic = perf_counter()
+
         # --- Gyro Integration (Gyroscope) ---
 
         # Calc l, magnitude of gyro reading
         l = math.sqrt(gyro_X[i] ** 2 + gyro_Y[i] ** 2 + gyro_Z[i] ** 2)
-        # Calc v_xyz, normalized gyro readings
-        v_x = gyro_X[i] / l
-        v_y = gyro_Y[i] / l
-        v_z = gyro_Z[i] / l
+        # Calc v_xyz, normalized gyro readings (0 reading = no rotation)
+        if l == 0:
+            v_x = v_y = v_z = 0.0
+        else:
+            v_x = gyro_X[i] / l
+            v_y = gyro_Y[i] / l
+            v_z = gyro_Z[i] / l
         # Calc theta
         theta = l * (time[i] - time[i - 1])
         # Calc quaternion
         w, x, y, z = v_theta_to_quaternion([v_x, v_y, v_z], theta)
         # Calc new q val
-        q_new = quaternion_product(q[-1], [w, x, y, z])
+        q_new = quaternion_product(q_prev, [w, x, y, z])
+
+        if timed:
+            toc = perf_counter()
+            gyro_time += toc - tic
+            tic = toc
 
         # --- Pitch & Roll Drift Correction (Accelerometer) ---
 
@@ -67,21 +88,28 @@ def yaw_correction(alpha, alpha_2):
         # Correct for drift
         q_new = quaternion_product(q_new, [w, x, y, z])
 
+        if timed:
+            toc = perf_counter()
+            tilt_time += toc - tic
+            tic = toc
+
         # --- Yaw Drift Correction (Magnetometer) ---
 
-        # Calculate q^-1 & q^-1_ref
+        # Calculate q^-1 & m'
         q_inverse = quaternion_to_conjugate(q_new)
-        q_ref_inverse = quaternion_to_conjugate(q_ref)
-        # Calculate m' & m_ref'
         m_next = quaternion_product(q_new, quaternion_product([0, magnet_X[i], magnet_Y[i], magnet_Z[i]], q_inverse))[1:]
-        m_ref_next = quaternion_product(q_ref, quaternion_product(m_ref, q_ref_inverse))[1:]
-        # Project m' & m_ref' into YX plane
+        # Project m' into YX plane
         theta = math.atan2(m_next[1], -m_next[0])
-        theta_r = math.atan2(m_ref_next[1], m_ref_next[0])
         # Correct for drift using complementary filter
         w, x, y, z = v_theta_to_quaternion([0, 0, 1], - alpha_2 * (theta - theta_r))
         q_new = quaternion_product(q_new, [w, x, y, z])
+        if timed:
+            yaw_time += perf_counter() - tic
         # Add corrected quaternion to q
-        q.append(q_new)
+        q[i] = q_prev = q_new
+
+    instrumentation.record('yaw_correction.gyro_step', gyro_time, len(time) - 1)
+    instrumentation.record('yaw_correction.tilt_step', tilt_time, len(time) - 1)
+    instrumentation.record('yaw_correction.yaw_step', yaw_time, len(time) - 1)
 
-    return q
+    return OrientationResult(q, data.time)